@@ -1,10 +1,10 @@
 
 import streamlit as st
-import pandas as pd
 import folium
 from streamlit_folium import st_folium
 from folium.plugins import MarkerCluster
-import random
+from legend import CompanyLegend, company_palette
+from ingest import UPLOAD_TYPES, describe_read, read_locations
 
 st.set_page_config(layout="wide")
 st.title("📍 Interactive Map Generator")
@@ -14,7 +14,7 @@ st.write("Upload an Excel file with columns: **Company Name**, **latitude**, **l
 @st.cache_data
 def generate_map(df):
     companies = df['Company Name'].unique()
-    colors = [f"#{random.randint(0, 0xFFFFFF):06x}" for _ in companies]
+    colors = company_palette(companies)
     color_map = dict(zip(companies, colors))
 
     center_lat = df['latitude'].mean()
@@ -37,21 +37,19 @@ def generate_map(df):
             popup=popup_info
         ).add_to(marker_cluster)
 
-    legend_html = '<div style="position: fixed; bottom: 50px; left: 50px; width: 250px; background-color: white; border:2px solid black; z-index:9999; font-size:14px; color:#000000; padding:10px;">'
-    legend_html += '<b>Company Legend</b><br>'
-    for company, color in color_map.items():
-        legend_html += f'<i style="background:{color};width:15px;height:15px;float:left;margin-right:8px;"></i>{company}<br>'
-    legend_html += '</div>'
-    m.get_root().html.add_child(folium.Element(legend_html))
+    # Legend renders only the entries in view; long lists get a search box
+    CompanyLegend(companies, colors).add_to(m)
 
 
 
     return m
 
-uploaded_file = st.file_uploader("Upload Excel file", type=["xlsx"])
+uploaded_file = st.file_uploader("Upload Excel, CSV or Parquet file", type=UPLOAD_TYPES)
 
 if uploaded_file:
-    df = pd.read_excel(uploaded_file, engine='openpyxl')
+    df, read_info = read_locations(uploaded_file.getvalue(), uploaded_file.name,
+                                   ['Company Name', 'Full Address (created)', 'latitude', 'longitude'])
+    st.caption(describe_read(read_info))
     required_cols = ['Company Name', 'latitude', 'longitude']
 
     if not all(col in df.columns for col in required_cols):
@@ -1,23 +1,32 @@
 
 import streamlit as st
-import pandas as pd
 import folium
 from streamlit_folium import st_folium
 import random
+from legend import CompanyLegend, company_palette
+from partition_index import PartitionIndex
+from ingest import UPLOAD_TYPES, describe_read, read_locations
 
 st.set_page_config(layout="wide")
 st.title("📍 Interactive Map Generator")
 st.write("Upload an Excel file with columns: **Company Name**, **latitude**, **longitude**")
 
+# Company -> row positions, built once per dataset and shared by the map and the filter
+@st.cache_data
+def company_index(df):
+    return PartitionIndex(df['Company Name'])
+
 # Cache map generation
 @st.cache_data
 def generate_map(df):
+    index = company_index(df)
     companies = df['Company Name'].unique()
     vibrant_colors = [
         "#FF0000", "#00FF00", "#0000FF", "#FFA500", "#800080",
         "#008080", "#FF1493", "#FFD700", "#00CED1", "#DC143C"
     ]
-    colors = [vibrant_colors[i % len(vibrant_colors)] for i in range(len(companies))]
+    # Stable per-name colors once there are more companies than fixed colors
+    colors = vibrant_colors[:len(companies)] if len(companies) <= len(vibrant_colors) else company_palette(companies)
     color_map = dict(zip(companies, colors))
 
     center_lat = df['latitude'].mean()
@@ -27,7 +36,7 @@ def generate_map(df):
     # Create FeatureGroups for each company
     for company in companies:
         fg = folium.FeatureGroup(name=company)
-        company_data = df[df['Company Name'] == company]
+        company_data = index.take(df, company)
         for _, row in company_data.iterrows():
             popup_info = f"<b>{company}</b><br>{row.get('Full Address (created)', '')}"
             folium.CircleMarker(
@@ -43,24 +52,17 @@ def generate_map(df):
     # Add Layer Control
     folium.LayerControl().add_to(m)
 
-    # Add legend for color reference
-    legend_html = '''
-    <div style="position: fixed; bottom: 50px; left: 50px; width: 250px; 
-    background-color: white; border:2px solid grey; z-index:9999; font-size:14px; 
-    padding:10px; color:#333333;">
-    <b style="color:#0000FF;">Company Legend</b><br>
-    '''
-    for company, color in color_map.items():
-        legend_html += f'<i style="background:{color};width:15px;height:15px;float:left;margin-right:8px;"></i><span style="color:#000000;">{company}</span><br>'
-    legend_html += '</div>'
-    m.get_root().html.add_child(folium.Element(legend_html))
+    # Legend renders only the entries in view; long lists get a search box
+    CompanyLegend(companies, colors).add_to(m)
 
     return m
 
-uploaded_file = st.file_uploader("Upload Excel file", type=["xlsx"])
+uploaded_file = st.file_uploader("Upload Excel, CSV or Parquet file", type=UPLOAD_TYPES)
 
 if uploaded_file:
-    df = pd.read_excel(uploaded_file, engine='openpyxl')
+    df, read_info = read_locations(uploaded_file.getvalue(), uploaded_file.name,
+                                   ['Company Name', 'Full Address (created)', 'latitude', 'longitude'])
+    st.caption(describe_read(read_info))
     required_cols = ['Company Name', 'latitude', 'longitude']
 
     if not all(col in df.columns for col in required_cols):
@@ -75,9 +77,10 @@ if "map" in st.session_state:
 # Search/filter feature
 if uploaded_file:
     st.subheader("🔍 Filter by Company")
-    selected_company = st.selectbox("Choose a company", options=["All"] + list(df['Company Name'].unique()))
+    index = company_index(df)
+    selected_company = st.selectbox("Choose a company", options=["All"] + list(index.keys))
     if selected_company != "All":
-        filtered_df = df[df['Company Name'] == selected_company]
+        filtered_df = index.take(df, selected_company)
         st.write(f"Showing {len(filtered_df)} locations for **{selected_company}**")
         st.dataframe(filtered_df[['Company Name', 'Full Address (created)', 'latitude', 'longitude']])
 
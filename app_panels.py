@@ -0,0 +1,491 @@
+import copy
+import hashlib
+
+import pandas as pd
+import streamlit as st
+from streamlit_folium import st_folium
+
+import pipeline
+from clustering import precompute_zoom_levels
+from dataset_cache import DatasetCache
+from density import precompute_density_levels
+from geocode_cache import GeocodeCache
+from geocoding import DEFAULT_REQUESTS_PER_SECOND, DEFAULT_MAX_IN_FLIGHT
+from ingest import UPLOAD_TYPES, describe_read
+from jobs import JobRunner
+from location_table import mapped_rows, memory_report
+from map_export import export_html
+from map_layers import (
+    MAX_QUERY_LINKS, PrerenderedLayer, cluster_view_layer, density_view_layer, spatial_query_layer, viewport_layer,
+    LARGE_DATASET_THRESHOLD,
+)
+from partition_index import PartitionIndex
+from perf import PerfRecorder, record_geocoding
+from pipeline import ADDRESS_COLUMN, build_company_layer, company_colors
+from spatial_index import GridIndex
+from spatial_query import nearest_join, pair_table, radius_join
+from table_export import EXPORT_FORMATS
+
+# The page of the map apps (app5, app6) and the sections it is built from.
+# Sections take the dataset's cache and hash, so whatever they precompute is
+# cached once per dataset for every app and session, and leave their map
+# layers in st.session_state for st_folium.
+
+# Most points drawn by the streaming preview
+PREVIEW_POINTS = 20_000
+
+
+@st.cache_resource
+def get_geocode_cache():
+    return GeocodeCache()
+
+
+# Offline gazetteer first (when available), Google only for what it cannot resolve.
+# Set GEOCODE_URL to point the HTTP backend at a local stand-in server.
+@st.cache_resource
+def get_geocoders():
+    return pipeline.make_geocoders(get_geocode_cache())
+
+
+@st.cache_resource
+def get_dataset_cache():
+    return DatasetCache()
+
+
+# Geocoding runs on the job runner's threads; scripts only submit uploads and poll their jobs
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(get_geocoders())
+
+
+# Each company's layer is cached separately, keyed by a fingerprint of its rows,
+# so only layers whose data or options changed are rebuilt.
+@st.cache_data(max_entries=5000, show_spinner=False)
+def company_layer(fingerprint, company, color, use_geojson, clustered, _valid_rows, _partition):
+    layer = build_company_layer(_partition.take(_valid_rows, company), company, color, use_geojson, clustered)
+    # Cache the rendered script, not the folium objects: unpickling thousands of markers costs as much as building them
+    return PrerenderedLayer(layer)
+
+
+def generate_map(df, use_clusters, use_geojson=False, large_dataset_threshold=LARGE_DATASET_THRESHOLD,
+                 dynamic_layers=False, partition=None, compact=False):
+    return pipeline.generate_map(
+        df, use_clusters, use_geojson, large_dataset_threshold,
+        dynamic_layers=dynamic_layers, partition=partition, compact=compact, company_layer=company_layer,
+    )
+
+
+def export_locations(dataset_cache, file_hash, df, fmt, file_bytes, file_name, perf):
+    """The upload with coordinates added, as a download in `fmt`; written only when requested, cached per dataset."""
+    kind = f"upload-{fmt}"
+    data = dataset_cache.get(file_hash, kind)
+    if data is None:
+        with perf.stage(f'export_{fmt}', rows=len(df)) as record:
+            data = pipeline.export_locations(df, fmt, file_bytes, file_name)
+            record['bytes'] = len(data)
+        dataset_cache.set(file_hash, kind, data)
+    return data
+
+
+def export_map(dataset_cache, file_hash, df, partition, settings, compact, compress, perf):
+    """Shareable HTML map, rendered only when downloaded and cached per dataset and render options."""
+    use_clusters, use_geojson = settings['use_clusters'], settings['use_geojson']
+    mapped = int(df[['latitude', 'longitude']].notna().all(axis=1).sum())
+    if mapped >= settings['large_dataset_threshold']:
+        options = "canvas"
+    else:
+        options = ("clusters" if use_clusters else "layers") + ("-compact" if compact else "-geojson" if use_geojson else "")
+    kind = f"map_html-{options}" + ("-min" if compact else "") + ("-gz" if compress else "")
+    data = dataset_cache.get(file_hash, kind)
+    if data is None:
+        with perf.stage('export_map', rows=mapped, options=kind) as record:
+            m = generate_map(df, use_clusters, use_geojson, settings['large_dataset_threshold'], partition=partition,
+                             compact=compact)
+            data = export_html(m, minify=compact, compress=compress)
+            record['bytes'] = len(data)
+        dataset_cache.set(file_hash, kind, data)
+    return data
+
+
+def grid_index(dataset_cache, file_hash, valid_rows):
+    """GridIndex over the mappable rows, built once per dataset."""
+    index = dataset_cache.get(file_hash, 'grid_index')
+    if index is None:
+        index = GridIndex(valid_rows['latitude'], valid_rows['longitude'])
+        dataset_cache.set(file_hash, 'grid_index', index)
+    return index
+
+
+def map_page(app, html_export=False):
+    """Upload, geocode and map a workbook: the whole page below the app's title.
+
+    With `html_export`, the map can also be downloaded as a shareable HTML file.
+    """
+    # Stage timings of this script run: logged as JSON lines, shown in the sidebar on request
+    perf = PerfRecorder(app=app)
+    show_perf = st.sidebar.checkbox("Show performance panel", value=False,
+                                    help="Wall time, rows, cache hits, HTML size and peak memory per stage of this run.")
+    try:
+        job_runner = get_job_runner()
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+    dataset_cache = get_dataset_cache()
+
+    uploaded_file = st.file_uploader("Upload Excel, CSV or Parquet file", type=UPLOAD_TYPES)
+    settings = settings_section()
+
+    if uploaded_file:
+        file_bytes = uploaded_file.getvalue()
+        file_hash = hashlib.sha256(file_bytes).hexdigest()
+        perf.context['dataset'] = file_hash[:12]
+        geocoded = geocoding_section(job_runner, dataset_cache, file_hash, file_bytes, uploaded_file.name, settings,
+                                     perf)
+        if geocoded is not None:
+            df, geocode_stats = geocoded
+            valid_rows, partition, indexes = map_section(dataset_cache, file_hash, df, settings, perf)
+
+            # Written only when downloaded, then cached with the dataset
+            export_format = st.selectbox("Download format", list(EXPORT_FORMATS),
+                                         format_func=lambda fmt: EXPORT_FORMATS[fmt][0])
+            label, mime = EXPORT_FORMATS[export_format]
+            st.download_button(
+                label=f"Download Updated {label}",
+                data=lambda: export_locations(dataset_cache, file_hash, df, export_format, file_bytes,
+                                              uploaded_file.name, perf),
+                file_name=f"updated_locations.{export_format}",
+                mime=mime
+            )
+
+            with st.expander("Memory use"):
+                st.dataframe(memory_report(**{
+                    "Location table as read": geocode_stats.get('memory_as_read', 0),
+                    "Location table (compact)": df,
+                    **indexes,
+                }))
+
+            # Radius and nearest-site questions over the mapped rows; matches are highlighted on the map
+            spatial_query_section(dataset_cache, file_hash, valid_rows, partition, perf)
+
+            if html_export:
+                map_download_section(dataset_cache, file_hash, df, partition, settings, perf)
+
+    if "map" in st.session_state:
+        map_view_section(show_perf, perf)
+
+    if show_perf:
+        with st.sidebar:
+            st.subheader("Performance")
+            if perf.stages:
+                st.dataframe(perf.table())
+            else:
+                st.caption("No stages ran in this run yet.")
+
+    st.write("### ✅ Important Information")
+    st.code("""
+Notes:
+   - You can turn on/off clustering of locations with the check box above the map
+   - For very large files, the density view shades map cells by how many locations they hold
+   - You can use the layer button in the top right area of the map to turn on/off different company locations
+   - You can download your original excel file with latitude and longitude now added
+   - You can find sites within a radius of, or nearest to, another company's sites (or a clicked point) under Spatial queries
+""" + ("   - You can download the HTML of your map and share it\n" if html_export else ""))
+
+
+def settings_section():
+    """Map, large-dataset and geocoding options, as a dict keyed by option name."""
+    settings = {
+        'use_clusters': st.checkbox("Enable Marker Clustering", value=False),
+        'use_geojson': st.checkbox(
+            "Fast rendering (one GeoJSON layer per company)", value=False,
+            help="Builds and loads much faster for large workbooks; same colors, popups and layers."),
+        'density_mode': st.checkbox(
+            "Density view instead of markers", value=False,
+            help="Counts the locations into map cells on the server and shades each cell by its count: fast at any "
+                 "number of locations."),
+    }
+    with st.expander("Large dataset settings"):
+        settings['server_clusters'] = st.checkbox(
+            "Precompute clusters on the server", value=False,
+            help="Ships one marker per cluster cell for the current zoom, plus raw points when zoomed in close.")
+        settings['density_shape'] = st.radio(
+            "Density cells", ["hex", "square"], horizontal=True,
+            format_func=lambda shape: "Hexagons" if shape == "hex" else "Squares")
+        settings['viewport_loading'] = st.checkbox(
+            "Load only the locations in view", value=False,
+            help="Loads the points inside the visible map area and more as you pan or zoom.")
+        settings['large_dataset_threshold'] = st.number_input(
+            "Use the canvas renderer above this many locations", min_value=1000, value=LARGE_DATASET_THRESHOLD,
+            step=1000, help="Points are sent as packed arrays, drawn on a canvas and clustered in the browser.")
+        settings['show_preview'] = st.checkbox(
+            "Preview points while geocoding", value=False,
+            help="Shows the locations geocoded so far on a small map while the job runs.")
+        settings['stream_upload'] = st.checkbox(
+            "Read the file in chunks", value=False,
+            help="Parses the upload a few thousand rows at a time: bounded memory for very large files, "
+                 "slower parsing and no overall progress bar.")
+    with st.expander("Geocoding settings"):
+        settings['requests_per_second'] = st.number_input(
+            "Max requests per second", min_value=1, max_value=500, value=DEFAULT_REQUESTS_PER_SECOND)
+        settings['max_in_flight'] = st.number_input(
+            "Max concurrent requests", min_value=1, max_value=64, value=DEFAULT_MAX_IN_FLIGHT)
+    return settings
+
+
+def geocoding_section(job_runner, dataset_cache, file_hash, file_bytes, file_name, settings, perf):
+    """(location table, stats) of the upload once geocoded; None while its job runs or after it failed."""
+    def submit(retry=False):
+        return job_runner.submit(file_hash, file_bytes, file_name, retry=retry, stream=settings['stream_upload'],
+                                 requests_per_second=settings['requests_per_second'],
+                                 max_in_flight=settings['max_in_flight'])
+
+    # Geocoded workbooks are memoized by content hash so reruns and new sessions skip geocoding
+    with perf.stage('load_dataset') as record:
+        geocoded = dataset_cache.get(file_hash, 'locations')
+        record['hit'] = geocoded is not None
+    if geocoded is None:
+        # A rerun, a refresh or another session with the same file attaches to the running job
+        job = submit()
+        if job.status == "done":
+            geocoded = job.result
+            st.caption(describe_read(geocoded[1]['read']))
+            record_geocoding(perf, geocoded[1])
+            # Lookups that exhausted their retries are not memoized, so retrying the job retries them
+            if not geocoded[1].get('gave_up'):
+                dataset_cache.set(file_hash, 'locations', geocoded)
+                job.release()
+        elif job.status == "failed":
+            st.error(job.error)
+            if st.button("Retry geocoding"):
+                submit(retry=True)
+                st.rerun()
+        else:
+            job_progress(job, settings['show_preview'])
+    if geocoded is None:
+        return None
+
+    geocode_stats = geocoded[1]
+    if geocode_stats['lookups_saved']:
+        st.info(f"Geocoded {geocode_stats['unique_lookups']} unique addresses; "
+                f"skipped {geocode_stats['lookups_saved']} duplicate lookups.")
+    st.info(f"Geocode cache: {geocode_stats['cache_hits']} hits, {geocode_stats['cache_misses']} misses")
+    if geocode_stats['resolved_by']:
+        st.caption("Resolved by backend: " + ", ".join(
+            f"{name}: {count}" for name, count in geocode_stats['resolved_by'].items()))
+    if geocode_stats.get('retries'):
+        rate = f" and the request rate to {geocode_stats['min_rate']}/s" if 'min_rate' in geocode_stats else ""
+        st.caption(f"Retried {geocode_stats['retries']} transient failures; "
+                   f"concurrency dropped to {geocode_stats['min_concurrency']}{rate} at the lowest.")
+    if geocode_stats.get('gave_up'):
+        st.warning(f"{geocode_stats['gave_up']} addresses still failed after retries "
+                   "(quota, server errors or timeouts).")
+        if st.button("Retry failed addresses"):
+            submit(retry=True)
+            st.rerun()
+    return geocoded
+
+
+# Polls the job on its own timer: no script run is held open while geocoding, and the page
+# reruns once the job finishes to draw the map
+@st.fragment(run_every=1.0)
+def job_progress(job, show_preview):
+    if job.finished:
+        st.rerun()
+    done, total = job.progress
+    if total:
+        text = f"Geocoding addresses... {done:,} of {total:,} rows."
+    elif done:
+        text = f"Geocoding addresses... {done:,} rows so far."
+    else:
+        text = f"Reading {job.file_name}..."
+    if job.resumed_rows:
+        text += f" Resumed {job.resumed_rows:,} rows from an interrupted run."
+    if total:
+        st.progress(done / total, text=text)
+    else:
+        # Streamed uploads are not counted before they are geocoded
+        st.caption(text)
+    if show_preview:
+        points = job.points()
+        if len(points):
+            st.caption(f"{len(points):,} locations mapped so far.")
+            # Thinned evenly so the preview stays light whatever the file size
+            st.map(points.iloc[::max(1, len(points) // PREVIEW_POINTS)], size=20)
+
+
+def map_section(dataset_cache, file_hash, df, settings, perf):
+    """The map of a geocoded table as st.session_state["map"], with its per-view layers in the view-dependent modes.
+
+    Returns (mappable rows, company index, the dataset indexes built for the
+    chosen mode keyed by their memory report label).
+    """
+    valid_rows = mapped_rows(df)
+    missing_count = len(df) - len(valid_rows)
+    if missing_count > 0:
+        st.warning(f"{missing_count} addresses could not be geocoded and will not appear on the map.")
+
+    st.success("Geocoding complete! Generating map...")
+    # Company -> row positions of the mappable rows, built once per dataset
+    partition = dataset_cache.get(file_hash, 'partition')
+    if partition is None:
+        with perf.stage('index', rows=len(valid_rows)):
+            partition = PartitionIndex(valid_rows['Company Name'])
+        dataset_cache.set(file_hash, 'partition', partition)
+    zoom_levels = index = density_levels = None
+    if settings['density_mode']:
+        density_levels = density_section(dataset_cache, file_hash, df, valid_rows, settings['density_shape'], perf)
+    elif settings['server_clusters']:
+        # Aggregates for every zoom level are computed once per dataset and cached with it
+        companies = df['Company Name'].unique()
+        zoom_levels = dataset_cache.get(file_hash, 'zoom_clusters')
+        if zoom_levels is None:
+            zoom_levels = precompute_zoom_levels(
+                valid_rows['latitude'], valid_rows['longitude'],
+                pd.Index(companies).get_indexer(valid_rows['Company Name']),
+            )
+            dataset_cache.set(file_hash, 'zoom_clusters', zoom_levels)
+        view = st.session_state.get("map_view") or {}
+        with perf.stage('view_layers', rows=len(valid_rows), mode='clusters'):
+            st.session_state["map_layers"] = cluster_view_layer(
+                valid_rows, zoom_levels, companies, company_colors(companies), ADDRESS_COLUMN,
+                zoom=view.get('zoom'), bounds=view.get('bounds'),
+            )
+    elif settings['viewport_loading']:
+        companies = df['Company Name'].unique()
+        index = grid_index(dataset_cache, file_hash, valid_rows)
+        view = st.session_state.get("map_view") or {}
+        with perf.stage('view_layers', rows=len(valid_rows), mode='viewport') as record:
+            st.session_state["map_layers"], shown, in_view = viewport_layer(
+                valid_rows, index, companies, company_colors(companies), ADDRESS_COLUMN,
+                bounds=view.get('bounds'),
+            )
+            record['shown'] = shown
+        if shown < in_view:
+            st.caption(f"Showing {shown:,} of {in_view:,} locations in view. Zoom in to load the rest.")
+    else:
+        st.session_state.pop("map_layers", None)
+        if len(df) - missing_count >= settings['large_dataset_threshold']:
+            st.info("Large dataset: using the canvas renderer with browser-side clustering.")
+    dynamic_layers = settings['density_mode'] or settings['server_clusters'] or settings['viewport_loading']
+    with perf.stage('generate_map', rows=len(valid_rows)):
+        st.session_state["map"] = generate_map(
+            df, settings['use_clusters'], settings['use_geojson'], settings['large_dataset_threshold'],
+            dynamic_layers=dynamic_layers, partition=partition,
+        )
+    return valid_rows, partition, {
+        "Company index": partition,
+        "Cluster levels": zoom_levels,
+        "Density cells": density_levels,
+        "Spatial index": index,
+    }
+
+
+def map_download_section(dataset_cache, file_hash, df, partition, settings, perf):
+    """Download of the map as HTML; rendered on click, with all the points even in the view-dependent modes."""
+    compact_export = st.checkbox(
+        "Compact map export", value=False,
+        help="Packed coordinates, one style per company and minified markup: a much smaller file.")
+    compress_export = st.checkbox("Gzip-compress the map export", value=False)
+    st.download_button(
+        label="Download Map as HTML",
+        data=lambda: export_map(dataset_cache, file_hash, df, partition, settings, compact_export, compress_export,
+                                perf),
+        file_name="interactive_map.html.gz" if compress_export else "interactive_map.html",
+        mime="application/gzip" if compress_export else "text/html"
+    )
+
+
+def map_view_section(show_perf, perf):
+    """st.session_state["map"] with the current per-view and query layers."""
+    if show_perf:
+        # Rendered separately only for the panel, and on a copy: every render appends folium's addTo scripts again
+        with perf.stage('render_html') as record:
+            record['bytes'] = len(copy.deepcopy(st.session_state["map"]).get_root().render().encode("utf-8"))
+    map_layers = [layer for layer in (st.session_state.get("map_layers"), st.session_state.get("query_layer"))
+                  if layer is not None]
+    # Includes st_folium's own rendering and the serialization sent to the browser
+    with perf.stage('st_folium'):
+        st_folium(st.session_state["map"], key="map_view", feature_group_to_add=map_layers or None,
+                  width=1700, height=900)
+
+
+def density_section(dataset_cache, file_hash, df, valid_rows, shape, perf):
+    """Density view of the current map view as st.session_state["map_layers"]; returns the cell counts of every level."""
+    # Cell counts for every zoom level and company are computed once per dataset and cached with it
+    companies = df['Company Name'].unique()
+    levels = dataset_cache.get(file_hash, f'density-{shape}')
+    if levels is None:
+        with perf.stage('density_levels', rows=len(valid_rows), shape=shape):
+            levels = precompute_density_levels(
+                valid_rows['latitude'], valid_rows['longitude'],
+                pd.Index(companies).get_indexer(valid_rows['Company Name']), shape,
+            )
+        dataset_cache.set(file_hash, f'density-{shape}', levels)
+    density_company = st.selectbox("Density of", ["All companies"] + list(companies))
+    code = None if density_company == "All companies" else pd.Index(companies).get_indexer([density_company])[0]
+    view = st.session_state.get("map_view") or {}
+    with perf.stage('view_layers', rows=len(valid_rows), mode='density') as record:
+        st.session_state["map_layers"], record['cells'] = density_view_layer(
+            levels, shape, zoom=view.get('zoom'), bounds=view.get('bounds'), code=code,
+        )
+    st.caption("Darker cells hold more locations (log scale); hover over a cell for its count.")
+    return levels
+
+
+def spatial_query_section(dataset_cache, file_hash, valid_rows, partition, perf):
+    """Radius and nearest-site questions over the mapped rows; matches are highlighted through st.session_state["query_layer"]."""
+    st.session_state.pop("query_layer", None)
+    with st.expander("Spatial queries"):
+        run_query = st.checkbox("Run a spatial query", value=False)
+        query_kind = st.radio("Find", ["Sites within a radius", "Nearest sites"], horizontal=True)
+        around = st.radio("Around", ["Each site of a company", "The last clicked point"], horizontal=True)
+        if around == "Each site of a company":
+            source_company = st.selectbox("Company", list(partition.keys))
+            target_company = st.selectbox(
+                "Matches from", ["Any other company"] + [c for c in partition.keys if c != source_company])
+        else:
+            target_company = st.selectbox("Matches from", ["All companies"] + list(partition.keys))
+        if query_kind == "Sites within a radius":
+            radius_km = st.number_input("Radius (km)", min_value=0.1, value=10.0, step=1.0)
+        else:
+            radius_km = None
+            neighbours = st.number_input("Nearest sites per query point", min_value=1, max_value=50, value=1)
+        if not run_query:
+            return
+
+        index = None
+        if target_company == "All companies":
+            target = valid_rows
+            # Same rows as the viewport index: shared through the dataset cache
+            index = grid_index(dataset_cache, file_hash, valid_rows)
+        elif target_company == "Any other company":
+            target = valid_rows[valid_rows['Company Name'] != source_company]
+        else:
+            target = partition.take(valid_rows, target_company)
+
+        if around == "Each site of a company":
+            source = partition.take(valid_rows, source_company)
+        else:
+            clicked = (st.session_state.get("map_view") or {}).get("last_clicked")
+            if not clicked:
+                st.info("Click a point on the map to query around it.")
+                return
+            source = pd.DataFrame({
+                'Company Name': ["Clicked point"],
+                ADDRESS_COLUMN: [f"{clicked['lat']:.5f}, {clicked['lng']:.5f}"],
+                'latitude': [clicked['lat']],
+                'longitude': [clicked['lng']],
+            })
+
+        with perf.stage('spatial_query', rows=len(target), queries=len(source),
+                        kind='radius' if radius_km is not None else 'nearest') as record:
+            if radius_km is not None:
+                pairs = radius_join(source, target, radius_km, index=index)
+            else:
+                pairs = nearest_join(source, target, int(neighbours), index=index)
+            record['matches'] = len(pairs)
+        st.caption(f"{len(pairs):,} matches for {pairs['source'].nunique():,} of {len(source):,} query sites.")
+        if len(pairs) > MAX_QUERY_LINKS:
+            st.caption(f"The map highlights the first {MAX_QUERY_LINKS:,} matches.")
+        st.dataframe(pair_table(pairs, source, target, ADDRESS_COLUMN), hide_index=True)
+        st.session_state["query_layer"] = spatial_query_layer(source, target, pairs, ADDRESS_COLUMN, radius_km=radius_km)
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from geocode_cache import GeocodeCache  # noqa: E402
+from geocoding import GoogleGeocoder, fill_missing_coordinates, make_session  # noqa: E402
+from mock_geocode_server import MockGeocodeServer  # noqa: E402
+
+STREETS = ["Main", "Oak", "Pine", "Maple", "Cedar", "Elm", "Washington", "Lake", "Hill", "Park"]
+SUFFIXES = ["St", "Ave", "Blvd", "Rd", "Dr", "Ln"]
+CITIES = [("Springfield", "IL"), ("Columbus", "OH"), ("Austin", "TX"), ("Denver", "CO"),
+          ("Portland", "OR"), ("Madison", "WI"), ("Raleigh", "NC"), ("Phoenix", "AZ")]
+
+
+def synthetic_workbook(rows, duplicate_ratio=0.2, companies=25, seed=0):
+    """Location table shaped like an uploaded workbook, with blank coordinates."""
+    rng = np.random.default_rng(seed)
+    unique = max(1, int(rows * (1 - duplicate_ratio)))
+    numbers = rng.integers(1, 20000, unique)
+    streets = rng.integers(0, len(STREETS), unique)
+    suffixes = rng.integers(0, len(SUFFIXES), unique)
+    cities = rng.integers(0, len(CITIES), unique)
+    zips = rng.integers(10000, 99999, unique)
+    addresses = np.array([
+        f"{numbers[i]} {STREETS[streets[i]]} {SUFFIXES[suffixes[i]]}, "
+        f"{CITIES[cities[i]][0]}, {CITIES[cities[i]][1]} {zips[i]}"
+        for i in range(unique)
+    ])
+    picks = np.concatenate([np.arange(unique), rng.integers(0, unique, rows - unique)])
+    rng.shuffle(picks)
+    return pd.DataFrame({
+        'Company Name': [f"Company {c}" for c in rng.integers(0, companies, rows)],
+        'Full Address': addresses[picks],
+        'latitude': np.nan,
+        'longitude': np.nan,
+    })
+
+
+class TimedGeocoder:
+    """Records the latency of every lookup attempt, including ones that raise."""
+
+    local = False
+
+    def __init__(self, geocoder):
+        self.geocoder = geocoder
+        self.name = geocoder.name
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def cached(self, address):
+        return self.geocoder.cached(address)
+
+    def geocode(self, address):
+        start = time.perf_counter()
+        try:
+            return self.geocoder.geocode(address)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.latencies.append(elapsed)
+
+
+def run_case(rows, args):
+    df = synthetic_workbook(rows, args.duplicate_ratio, seed=args.seed)
+    server = MockGeocodeServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                               zero_results_rate=args.zero_results_rate, rate_limit=args.rate_limit,
+                               seed=args.seed)
+    with server, tempfile.TemporaryDirectory() as tmp:
+        cache = GeocodeCache(os.path.join(tmp, "cache.sqlite3")) if args.with_cache else None
+        geocoder = TimedGeocoder(GoogleGeocoder("benchmark", url=server.url,
+                                                session=make_session(args.max_in_flight), cache=cache))
+        start = time.perf_counter()
+        stats = fill_missing_coordinates(df, 'Full Address', [geocoder],
+                                         requests_per_second=args.rps, max_in_flight=args.max_in_flight)
+        wall = time.perf_counter() - start
+
+    latencies_ms = np.array(geocoder.latencies) * 1000 if geocoder.latencies else np.zeros(1)
+    return {
+        'rows': rows,
+        'unique_addresses': stats['unique_lookups'],
+        'wall_time_s': round(wall, 4),
+        'rows_per_sec': round(rows / wall, 2) if wall else None,
+        'lookups_per_sec': round(len(geocoder.latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+            'p95': round(float(np.percentile(latencies_ms, 95)), 3),
+            'p99': round(float(np.percentile(latencies_ms, 99)), 3),
+        },
+        'lookup_attempts': len(geocoder.latencies),
+        'retries': stats.get('retries', 0),
+        'gave_up': stats.get('gave_up', 0),
+        'min_concurrency': stats.get('min_concurrency'),
+        'min_rate': stats.get('min_rate'),
+        'unresolved_rows': int(df['latitude'].isna().sum()),
+        'server_requests': server.requests,
+        'server_throttled': server.throttled,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {case['rows']: case for case in json.load(f)['cases']}
+    for case in results['cases']:
+        base = baseline.get(case['rows'])
+        if not base or not base.get('rows_per_sec'):
+            continue
+        change = (case['rows_per_sec'] - base['rows_per_sec']) / base['rows_per_sec'] * 100
+        print(f"{case['rows']:>8} rows: {base['rows_per_sec']:>10.1f} -> {case['rows_per_sec']:>10.1f} rows/s "
+              f"({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the geocoding engine against a local mock server.")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="comma-separated row counts")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0.02, help="mock server mean latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.01, help="mock server latency std dev (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--zero-results-rate", type=float, default=0.01)
+    parser.add_argument("--rate-limit", type=int, default=None, help="mock server QPS before OVER_QUERY_LIMIT")
+    parser.add_argument("--rps", type=float, default=2000, help="client requests-per-second limit")
+    parser.add_argument("--max-in-flight", type=int, default=32)
+    parser.add_argument("--with-cache", action="store_true", help="geocode through a fresh SQLite cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare rows/sec against a previous JSON result")
+    args = parser.parse_args()
+
+    results = {
+        'benchmark': 'geocoding',
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare')},
+        'cases': [],
+    }
+    for rows in (int(size) for size in args.sizes.split(",")):
+        case = run_case(rows, args)
+        results['cases'].append(case)
+        print(f"{rows:>8} rows  {case['wall_time_s']:>8.2f} s  {case['rows_per_sec']:>10.1f} rows/s  "
+              f"p50 {case['latency_ms']['p50']:.1f} ms  p95 {case['latency_ms']['p95']:.1f} ms  "
+              f"p99 {case['latency_ms']['p99']:.1f} ms  retries {case['retries']}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
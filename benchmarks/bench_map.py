@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import platform
+import runpy
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench_geocoding import git_revision  # noqa: E402
+
+# name: (where the variant comes from, how it is built)
+VARIANTS = {
+    'clustered-iterrows': "app.py: one CircleMarker per row from iterrows, in a MarkerCluster",
+    'layers-iterrows': "app3.py: one FeatureGroup per company filled from iterrows",
+    'layers': "pipeline (app5/app6): one FeatureGroup of CircleMarkers per company",
+    'clustered': "pipeline (app5/app6): per-company layers in a MarkerCluster",
+    'geojson': "pipeline (app5/app6): one GeoJSON layer per company",
+    'compact': "pipeline (app6 compact export): packed coordinates per company",
+    'canvas': "pipeline (app5/app6 large datasets): canvas renderer with client-side clustering",
+    'density': "app5/app6 density view: hexagon cell counts for every zoom, initial view rendered",
+}
+CITIES = [(39.78, -89.65), (39.96, -83.00), (30.27, -97.74), (39.74, -104.99),
+          (45.52, -122.68), (43.07, -89.40), (35.78, -78.64), (33.45, -112.07)]
+
+
+def synthetic_locations(rows, companies=25, duplicate_ratio=0.2, spread=1.0, seed=0):
+    """Geocoded location table shaped like an uploaded workbook.
+
+    A `duplicate_ratio` share of rows repeat an earlier address (and its
+    coordinates). Points scatter around a handful of US cities with a normal
+    spread of `spread` degrees; 0 puts every point of a city on one spot.
+    """
+    rng = np.random.default_rng(seed)
+    unique = max(1, int(rows * (1 - duplicate_ratio)))
+    cities = rng.integers(0, len(CITIES), unique)
+    centers = np.array(CITIES)[cities]
+    coords = centers + rng.normal(0, spread, (unique, 2)) if spread else centers
+    addresses = np.array([f"{rng.integers(1, 20000)} Main St, City {city}" for city in cities])
+    picks = np.concatenate([np.arange(unique), rng.integers(0, unique, rows - unique)])
+    rng.shuffle(picks)
+    return pd.DataFrame({
+        'Company Name': [f"Company {c}" for c in rng.integers(0, companies, rows)],
+        'Full Address': addresses[picks],
+        'latitude': np.round(coords[picks, 0], 6),
+        'longitude': np.round(coords[picks, 1], 6),
+    })
+
+
+def write_workbook(df, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        df.to_csv(path, index=False)
+    elif extension == ".parquet":
+        df.to_parquet(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+
+
+def map_builder(variant):
+    """Function(df) -> folium.Map for a variant."""
+    if variant.endswith('-iterrows'):
+        os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+        # The apps are scripts: run them bare (no upload, so they stop at the uploader) and take generate_map
+        script = 'app.py' if variant == 'clustered-iterrows' else 'app3.py'
+        generate = runpy.run_path(os.path.join(REPO_ROOT, script))['generate_map'].__wrapped__
+
+        def build(df):
+            return generate(df.rename(columns={'Full Address': 'Full Address (created)'}))
+        return build
+
+    import pipeline
+    from density import precompute_density_levels
+    from location_table import compact_locations, mapped_rows
+    from map_layers import density_view_layer
+
+    def build(df):
+        table = compact_locations(df, 'Full Address')
+        if variant == 'density':
+            m = pipeline.generate_map(table, False, dynamic_layers=True)
+            rows = mapped_rows(table)
+            codes = pd.Index(table['Company Name'].unique()).get_indexer(rows['Company Name'])
+            levels = precompute_density_levels(rows['latitude'], rows['longitude'], codes)
+            density_view_layer(levels, "hex")[0].add_to(m)
+            return m
+        if variant == 'canvas':
+            return pipeline.generate_map(table, False, large_dataset_threshold=0)
+        return pipeline.generate_map(table, variant == 'clustered', use_geojson=variant == 'geojson',
+                                     large_dataset_threshold=len(df) + 1, compact=variant == 'compact')
+    return build
+
+
+def run_case(variant, rows, args):
+    """Build and render one map in this process; peak memory is the process high-water mark."""
+    from perf import peak_rss_mb
+
+    df = synthetic_locations(rows, args.companies, args.duplicate_ratio, args.spread, args.seed)
+    build = map_builder(variant)
+    baseline_mb = peak_rss_mb()
+    start = time.perf_counter()
+    m = build(df)
+    built = time.perf_counter()
+    html = m.get_root().render()
+    rendered = time.perf_counter()
+    return {
+        'variant': variant,
+        'rows': rows,
+        'build_s': round(built - start, 4),
+        'render_s': round(rendered - built, 4),
+        'total_s': round(rendered - start, 4),
+        'html_bytes': len(html.encode("utf-8")),
+        'peak_memory_mb': round(peak_rss_mb() - baseline_mb, 1) if baseline_mb is not None else None,
+    }
+
+
+def run_isolated(variant, rows, args):
+    # One process per case, so each peak-memory figure is that case's own
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", f"{variant}:{rows}",
+               "--companies", str(args.companies), "--duplicate-ratio", str(args.duplicate_ratio),
+               "--spread", str(args.spread), "--seed", str(args.seed)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline_path, tolerance):
+    """Print changes against a baseline; returns the cases slower or larger by more than `tolerance` percent."""
+    with open(baseline_path) as f:
+        baseline = {(case['variant'], case['rows']): case for case in json.load(f)['cases']}
+    regressions = []
+    for case in results['cases']:
+        base = baseline.get((case['variant'], case['rows']))
+        if not base:
+            continue
+        changes = []
+        for metric in ('total_s', 'html_bytes', 'peak_memory_mb'):
+            if not base.get(metric) or case.get(metric) is None:
+                continue
+            change = (case[metric] - base[metric]) / base[metric] * 100
+            changes.append(f"{metric} {change:+.1f}%")
+            if change > tolerance:
+                regressions.append((case['variant'], case['rows'], metric, change))
+        print(f"{case['variant']:>20} {case['rows']:>8} rows: " + ", ".join(changes))
+    for variant, rows, metric, change in regressions:
+        print(f"REGRESSION {variant} at {rows} rows: {metric} {change:+.1f}% (tolerance {tolerance:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark map building and rendering on synthetic workbooks.")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated row counts")
+    parser.add_argument("--variants", default=",".join(VARIANTS),
+                        help=f"comma-separated map variants: {', '.join(VARIANTS)}")
+    parser.add_argument("--companies", type=int, default=25)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2)
+    parser.add_argument("--spread", type=float, default=1.0, help="std dev of points around each city (degrees)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path (e.g. to keep as a baseline)")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=20.0,
+                        help="percent slower/larger than the baseline that counts as a regression")
+    parser.add_argument("--generate", metavar="PATH",
+                        help="write one synthetic workbook (.xlsx, .csv or .parquet) of the first size and exit")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    if args.run_case:
+        variant, rows = args.run_case.split(":")
+        print(json.dumps(run_case(variant, int(rows), args)))
+        return 0
+    if args.generate:
+        write_workbook(synthetic_locations(sizes[0], args.companies, args.duplicate_ratio, args.spread, args.seed),
+                       args.generate)
+        return 0
+
+    variants = [variant for variant in args.variants.split(",") if variant]
+    unknown = [variant for variant in variants if variant not in VARIANTS]
+    if unknown:
+        parser.error(f"unknown variant(s): {', '.join(unknown)}")
+
+    results = {
+        'benchmark': 'map_build',
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'generate', 'run_case')},
+        'cases': [],
+    }
+    for rows in sizes:
+        for variant in variants:
+            case = run_isolated(variant, rows, args)
+            results['cases'].append(case)
+            print(f"{variant:>20} {rows:>8} rows  build {case['build_s']:>8.2f} s  render {case['render_s']:>8.2f} s  "
+                  f"html {case['html_bytes'] / 1e6:>8.2f} MB  peak +{case['peak_memory_mb']} MB", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare and compare(results, args.compare, args.tolerance):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
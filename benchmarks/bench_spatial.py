@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench_geocoding import git_revision  # noqa: E402
+
+# name: (where the query sites are, where the candidate sites are)
+SCENARIOS = {
+    'clustered': "query sites nationwide, candidate sites in one city",
+    'clustered-local': "query and candidate sites in the same city",
+    'uniform': "query and candidate sites spread over the continental US",
+}
+CITY = (41.88, -87.63)
+CITY_SPREAD = 0.05      # degrees, std dev of sites around the city
+
+
+def synthetic_sites(scenario, sources, targets, seed=0):
+    """(source lats, source lngs, target lats, target lngs) for a scenario."""
+    rng = np.random.default_rng(seed)
+
+    def nationwide(n):
+        return rng.uniform(25, 49, n), rng.uniform(-124, -67, n)
+
+    def city(n):
+        return CITY[0] + rng.normal(0, CITY_SPREAD, n), CITY[1] + rng.normal(0, CITY_SPREAD, n)
+
+    source = city(sources) if scenario == 'clustered-local' else nationwide(sources)
+    target = nationwide(targets) if scenario == 'uniform' else city(targets)
+    return (*source, *target)
+
+
+def brute_force_nearest(index, lats, lngs, k):
+    """k-th nearest distance for each query point, measured against every indexed point."""
+    from spatial_index import haversine_km
+
+    k = min(k, len(index))
+    return np.array([np.sort(haversine_km(lat, lng, index.lats, index.lngs))[k - 1] for lat, lng in zip(lats, lngs)])
+
+
+def run_case(scenario, sources, targets, args):
+    """Index the targets and find the nearest of them to every source in this process.
+
+    Results for a sample of `args.check` sources are compared with a brute-force
+    search; peak memory is the process high-water mark.
+    """
+    from perf import peak_rss_mb
+    from spatial_index import GridIndex
+
+    source_lats, source_lngs, target_lats, target_lngs = synthetic_sites(scenario, sources, targets, args.seed)
+    baseline_mb = peak_rss_mb()
+    start = time.perf_counter()
+    index = GridIndex(target_lats, target_lngs)
+    built = time.perf_counter()
+    query, positions, distances = index.query_nearest(source_lats, source_lngs, args.k)
+    queried = time.perf_counter()
+    peak_mb = peak_rss_mb()
+
+    sample = np.random.default_rng(args.seed).choice(sources, min(args.check, sources), replace=False)
+    expected = brute_force_nearest(index, source_lats[sample], source_lngs[sample], args.k)
+    counts = np.bincount(query, minlength=sources)
+    last = np.cumsum(counts) - 1
+    found = distances[last[sample]]
+    mismatches = int((counts[sample] != min(args.k, targets)).sum() + (~np.isclose(found, expected, atol=1e-6)).sum())
+    return {
+        'scenario': scenario,
+        'sources': sources,
+        'targets': targets,
+        'k': args.k,
+        'index_s': round(built - start, 4),
+        'query_s': round(queried - built, 4),
+        'matches': len(query),
+        'peak_memory_mb': round(peak_mb - baseline_mb, 1) if baseline_mb is not None else None,
+        'checked': len(sample),
+        'mismatches': mismatches,
+    }
+
+
+def run_isolated(scenario, sources, targets, args):
+    # One process per case, so each peak-memory figure is that case's own
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", f"{scenario}:{sources}x{targets}",
+               "--k", str(args.k), "--check", str(args.check), "--seed", str(args.seed)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline_path, tolerance):
+    """Print changes against a baseline; returns the cases slower or larger by more than `tolerance` percent."""
+    with open(baseline_path) as f:
+        baseline = {(case['scenario'], case['sources'], case['targets']): case for case in json.load(f)['cases']}
+    regressions = []
+    for case in results['cases']:
+        base = baseline.get((case['scenario'], case['sources'], case['targets']))
+        if not base:
+            continue
+        changes = []
+        for metric in ('query_s', 'peak_memory_mb'):
+            if not base.get(metric) or case.get(metric) is None:
+                continue
+            change = (case[metric] - base[metric]) / base[metric] * 100
+            changes.append(f"{metric} {change:+.1f}%")
+            if change > tolerance:
+                regressions.append((case['scenario'], case['sources'], case['targets'], metric, change))
+        print(f"{case['scenario']:>16} {case['sources']:>8} x {case['targets']:<8}: " + ", ".join(changes))
+    for scenario, sources, targets, metric, change in regressions:
+        print(f"REGRESSION {scenario} at {sources} x {targets}: {metric} {change:+.1f}% (tolerance {tolerance:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark nearest-site queries on synthetic sites and check them against a brute-force search.")
+    parser.add_argument("--sizes", default="1000x20000,4000x100000",
+                        help="comma-separated SOURCESxTARGETS site counts")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"comma-separated scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument("--k", type=int, default=1, help="nearest sites per query site")
+    parser.add_argument("--check", type=int, default=200, help="query sites checked against a brute-force search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON to this path (e.g. to keep as a baseline)")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare against a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=20.0,
+                        help="percent slower/larger than the baseline that counts as a regression")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        scenario, size = args.run_case.split(":")
+        sources, targets = (int(count) for count in size.split("x"))
+        print(json.dumps(run_case(scenario, sources, targets, args)))
+        return 0
+
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    unknown = [scenario for scenario in scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    results = {
+        'benchmark': 'spatial_query',
+        'revision': git_revision(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'run_case')},
+        'cases': [],
+    }
+    for size in args.sizes.split(","):
+        sources, targets = (int(count) for count in size.split("x"))
+        for scenario in scenarios:
+            case = run_isolated(scenario, sources, targets, args)
+            results['cases'].append(case)
+            print(f"{scenario:>16} {sources:>8} x {targets:<8} query {case['query_s']:>8.2f} s  "
+                  f"index {case['index_s']:>6.2f} s  peak +{case['peak_memory_mb']} MB  "
+                  f"mismatches {case['mismatches']}/{case['checked']}", flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    failed = [case for case in results['cases'] if case['mismatches']]
+    for case in failed:
+        print(f"WRONG RESULTS {case['scenario']} at {case['sources']} x {case['targets']}: "
+              f"{case['mismatches']} of {case['checked']} checked query sites")
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else []
+    return 1 if failed or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for the Google Geocoding JSON API, for benchmarks and manual testing.
+#   GEOCODE_URL=http://127.0.0.1:8765/maps/api/geocode/json streamlit run app6.py
+
+
+class MockGeocodeServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.02, jitter=0.01, error_rate=0.0,
+                 zero_results_rate=0.0, rate_limit=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.zero_results_rate = zero_results_rate
+        self.rate_limit = rate_limit
+        self.requests = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/maps/api/geocode/json"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _over_limit(self):
+        # Fixed one-second window, like the per-second QPS quota
+        with self._lock:
+            self.requests += 1
+            if not self.rate_limit:
+                return False
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            if self._window_count > self.rate_limit:
+                self.throttled += 1
+                return True
+            return False
+
+    def _respond(self, address):
+        with self._lock:
+            delay = max(0.0, self._random.gauss(self.latency, self.jitter))
+            roll = self._random.random()
+        time.sleep(delay)
+        if self._over_limit():
+            return 200, {'status': 'OVER_QUERY_LIMIT', 'results': []}
+        if roll < self.error_rate / 2:
+            return 503, None
+        if roll < self.error_rate:
+            return 200, {'status': 'UNKNOWN_ERROR', 'results': []}
+        if roll < self.error_rate + self.zero_results_rate:
+            return 200, {'status': 'ZERO_RESULTS', 'results': []}
+        # Deterministic coordinates per address, spread over the continental US
+        digest = int(hashlib.md5(address.lower().encode()).hexdigest(), 16)
+        lat = 25.0 + (digest % 2400) / 100
+        lng = -124.0 + (digest // 2400 % 5700) / 100
+        return 200, {'status': 'OK', 'results': [{'geometry': {'location': {'lat': lat, 'lng': lng}}}]}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                status, body = server._respond(query.get('address', [''])[0])
+                payload = json.dumps(body).encode() if body is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock Google Geocoding API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.02, help="mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="latency standard deviation in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 503 / UNKNOWN_ERROR responses")
+    parser.add_argument("--zero-results-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int, default=None, help="requests per second before OVER_QUERY_LIMIT")
+    args = parser.parse_args()
+
+    server = MockGeocodeServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                               args.zero_results_rate, args.rate_limit)
+    print(f"Serving mock geocoder at {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
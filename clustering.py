@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+
+from spatial_index import view_box
+
+# Server-side clustering: points are binned into screen-sized Web Mercator grid
+# cells once per zoom level, so the browser only receives one marker per cell.
+TILE_SIZE = 256
+CELL_PIXELS = 64
+MIN_ZOOM = 1
+RAW_POINTS_ZOOM = 13        # at or above this zoom the raw points in view are shipped instead
+MAX_LATITUDE = 85.05112878
+VIEW_MARGIN = 0.25          # extra fraction of the viewport loaded on each side
+
+
+def mercator_pixels(lats, lngs, zoom):
+    scale = TILE_SIZE * 2.0 ** zoom
+    lat = np.radians(np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lngs, dtype=float) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0 * scale
+    return x, y
+
+
+def grid_aggregates(lats, lngs, codes, zoom, cell_pixels=CELL_PIXELS):
+    """Count, centroid and dominant company code for every occupied grid cell at `zoom`."""
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    codes = np.asarray(codes)
+    if not len(lats):
+        return pd.DataFrame(columns=['latitude', 'longitude', 'count', 'dominant_code', 'dominant_count'])
+
+    x, y = mercator_pixels(lats, lngs, zoom)
+    cells_per_row = int(np.ceil(TILE_SIZE * 2 ** zoom / cell_pixels)) + 1
+    cell = (y // cell_pixels).astype(np.int64) * cells_per_row + (x // cell_pixels).astype(np.int64)
+    _, inverse, counts = np.unique(cell, return_inverse=True, return_counts=True)
+
+    # Most frequent company per cell: count (cell, code) pairs, keep the largest per cell
+    pairs = pd.DataFrame({'cell': inverse, 'code': codes}).value_counts(sort=True).reset_index()
+    top = pairs.drop_duplicates('cell').sort_values('cell')
+
+    return pd.DataFrame({
+        'latitude': np.bincount(inverse, weights=lats) / counts,
+        'longitude': np.bincount(inverse, weights=lngs) / counts,
+        'count': counts,
+        'dominant_code': top['code'].to_numpy(),
+        'dominant_count': top['count'].to_numpy(),
+    })
+
+
+def precompute_zoom_levels(lats, lngs, codes, min_zoom=MIN_ZOOM, max_zoom=RAW_POINTS_ZOOM - 1):
+    return {zoom: grid_aggregates(lats, lngs, codes, zoom) for zoom in range(min_zoom, max_zoom + 1)}
+
+
+def viewport_mask(lats, lngs, bounds, margin=VIEW_MARGIN):
+    """Boolean mask of points inside st_folium `bounds`, widened by `margin` of the view size."""
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    box = view_box(bounds, margin)
+    if box is None:
+        return np.ones(len(lats), dtype=bool)
+    south, west, north, east = box
+    return (lats >= south) & (lats <= north) & (lngs >= west) & (lngs <= east)
@@ -0,0 +1,75 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Per-dataset results (geocoded tables, derived aggregates, ...) keyed by the
+# uploaded file's content hash. Kept in memory for reruns and pickled to disk so
+# new sessions and restarted servers can reuse them.
+DEFAULT_CACHE_DIR = os.environ.get(
+    "DATASET_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".dataset_cache"),
+)
+DEFAULT_MEMORY_ENTRIES = 16
+DEFAULT_DISK_ENTRIES = 200
+# Part of every file name; bump it when the layout of cached values changes so old pickles are ignored
+CACHE_FORMAT = 3
+
+
+class DatasetCache:
+    """Two-level (memory + disk) cache. Values are shared between sessions; treat them as read-only."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 disk_entries=DEFAULT_DISK_ENTRIES):
+        self.directory = directory
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, dataset_hash, kind):
+        return os.path.join(self.directory, f"{dataset_hash}.{kind}.v{CACHE_FORMAT}.pkl")
+
+    def get(self, dataset_hash, kind):
+        key = (dataset_hash, kind)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+        path = self._path(dataset_hash, kind)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        os.utime(path)
+        self._remember(key, value)
+        return value
+
+    def set(self, dataset_hash, kind, value):
+        self._remember((dataset_hash, kind), value)
+        path = self._path(dataset_hash, kind)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._evict_disk()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = [e for e in os.scandir(self.directory) if e.name.endswith(".pkl")]
+        if len(entries) <= self.disk_entries:
+            return
+        entries.sort(key=lambda e: e.stat().st_mtime)
+        for entry in entries[:len(entries) - self.disk_entries]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+
+from clustering import MIN_ZOOM, RAW_POINTS_ZOOM, VIEW_MARGIN, mercator_pixels
+from spatial_index import view_box
+
+# Density view: points are counted into screen-sized hexagon or square cells of
+# the Web Mercator pixel grid, once per zoom level and per company, so a view
+# costs one polygon per occupied cell whatever the number of rows.
+DENSITY_CELL_PIXELS = 24    # square side; hexagons get the same area
+DENSITY_SHAPES = ("hex", "square")
+MAX_VIEW_CELLS = 20_000    # a view holding more falls back to a coarser level
+HEX_SIZE_RATIO = np.sqrt(2 / (3 * np.sqrt(3)))    # circumradius of a hexagon with unit area
+
+
+def hex_size(cell_pixels=DENSITY_CELL_PIXELS):
+    return cell_pixels * HEX_SIZE_RATIO
+
+
+def _hex_cells(x, y, size):
+    # Pointy-top axial coordinates, rounded through cube coordinates
+    q = (np.sqrt(3) / 3 * x - y / 3) / size
+    r = 2 / 3 * y / size
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    centers_x = size * np.sqrt(3) * (rq + rr / 2)
+    centers_y = size * 1.5 * rr
+    return rq.astype(np.int64), rr.astype(np.int64), centers_x, centers_y
+
+
+def _square_cells(x, y, side):
+    i = np.floor(x / side)
+    j = np.floor(y / side)
+    return i.astype(np.int64), j.astype(np.int64), (i + 0.5) * side, (j + 0.5) * side
+
+
+def density_grid(lats, lngs, codes, zoom, shape="hex", cell_pixels=DENSITY_CELL_PIXELS):
+    """Occupied cells at `zoom` and their per-company counts.
+
+    Returns (cells, company_counts): cells has the cell centre in world pixels
+    at `zoom` (x, y) and the total count; company_counts has one row per
+    (cell position, company code) pair with its count.
+    """
+    if shape not in DENSITY_SHAPES:
+        raise ValueError(f"Unknown density cell shape: {shape}")
+    lats = np.asarray(lats, dtype=float)
+    lngs = np.asarray(lngs, dtype=float)
+    codes = np.asarray(codes, dtype=np.int64)
+    if not len(lats):
+        return (pd.DataFrame({'x': np.array([], np.float32), 'y': np.array([], np.float32),
+                              'count': np.array([], np.uint32)}),
+                pd.DataFrame({'cell': np.array([], np.int32), 'code': np.array([], np.int32),
+                              'count': np.array([], np.uint32)}))
+
+    x, y = mercator_pixels(lats, lngs, zoom)
+    if shape == "hex":
+        i, j, centers_x, centers_y = _hex_cells(x, y, hex_size(cell_pixels))
+    else:
+        i, j, centers_x, centers_y = _square_cells(x, y, cell_pixels)
+    _, first, inverse, counts = np.unique(i * (1 << 32) + j, return_index=True, return_inverse=True,
+                                          return_counts=True)
+    cells = pd.DataFrame({
+        'x': centers_x[first].astype(np.float32),
+        'y': centers_y[first].astype(np.float32),
+        'count': counts.astype(np.uint32),
+    })
+
+    # Company breakdown: count (cell, code) pairs
+    n_codes = int(codes.max()) + 2 if len(codes) else 1
+    pairs, pair_counts = np.unique(inverse * n_codes + (codes + 1), return_counts=True)
+    company_counts = pd.DataFrame({
+        'cell': (pairs // n_codes).astype(np.int32),
+        'code': (pairs % n_codes - 1).astype(np.int32),
+        'count': pair_counts.astype(np.uint32),
+    })
+    return cells, company_counts
+
+
+def precompute_density_levels(lats, lngs, codes, shape="hex", min_zoom=MIN_ZOOM, max_zoom=RAW_POINTS_ZOOM - 1):
+    return {zoom: density_grid(lats, lngs, codes, zoom, shape) for zoom in range(min_zoom, max_zoom + 1)}
+
+
+def density_view(levels, zoom=None, bounds=None, code=None, max_cells=MAX_VIEW_CELLS):
+    """(level zoom, cells in view, largest count of the level) for a map view.
+
+    Views zoomed in past the finest level reuse it; a view holding more than
+    `max_cells` cells falls back to coarser levels. With `code`, counts are
+    those of that company only.
+    """
+    level = min(max(min(levels), int(zoom if zoom is not None else min(levels))), max(levels))
+    while True:
+        cells, company_counts = levels[level]
+        if code is not None:
+            rows = company_counts[company_counts['code'] == code]
+            cells = cells.iloc[rows['cell'].to_numpy()].assign(count=rows['count'].to_numpy())
+        max_count = int(cells['count'].max()) if len(cells) else 0
+        cells = cells[_in_view(cells, bounds, level)]
+        if len(cells) <= max_cells or level == min(levels):
+            return level, cells, max_count
+        level -= 1
+
+
+def _in_view(cells, bounds, zoom):
+    box = view_box(bounds, margin=VIEW_MARGIN)
+    if box is None:
+        return np.ones(len(cells), dtype=bool)
+    south, west, north, east = box
+    left, top = mercator_pixels(np.array([north]), np.array([west]), zoom)
+    right, bottom = mercator_pixels(np.array([south]), np.array([east]), zoom)
+    x = cells['x'].to_numpy()
+    y = cells['y'].to_numpy()
+    return (x >= left[0]) & (x <= right[0]) & (y >= top[0]) & (y <= bottom[0])
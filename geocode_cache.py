@@ -0,0 +1,100 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Persistent geocode cache shared by the geocoding apps.
+DEFAULT_CACHE_PATH = os.environ.get(
+    "GEOCODE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".geocode_cache.sqlite3"),
+)
+DEFAULT_TTL = 90 * 24 * 3600           # successful lookups: 90 days
+DEFAULT_NEGATIVE_TTL = 7 * 24 * 3600   # failed lookups: retry after a week
+DEFAULT_MAX_ENTRIES = 250_000
+EVICT_EVERY = 500                      # check the size cap every N writes
+
+
+def normalize_address(address):
+    if address is None or (isinstance(address, float) and address != address):
+        return ""
+    text = re.sub(r"[^\w\s]", " ", str(address).lower())
+    return " ".join(text.split())
+
+
+class GeocodeCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            " key TEXT PRIMARY KEY, lat REAL, lng REAL,"
+            " expires_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)")
+        self._conn.commit()
+        with self._lock:
+            self._evict()
+
+    def get(self, address):
+        """Return (found, lat, lng). A found entry with lat None is a cached failure."""
+        key = normalize_address(address)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT lat, lng, expires_at FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[2] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return False, None, None
+            self._conn.execute("UPDATE geocode SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return True, row[0], row[1]
+
+    def set(self, address, lat, lng):
+        key = normalize_address(address)
+        if not key:
+            return
+        now = time.time()
+        ttl = self.ttl if lat is not None and lng is not None else self.negative_ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lng, expires_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, lat, lng, now + ttl, now),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self):
+        # Drop expired entries, then the least recently used ones above the size cap.
+        self._conn.execute("DELETE FROM geocode WHERE expires_at < ?", (time.time(),))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM geocode WHERE key IN "
+                "(SELECT key FROM geocode ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count}
@@ -0,0 +1,516 @@
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from geocode_cache import normalize_address
+
+GEOCODE_URL = "https://maps.googleapis.com/maps/api/geocode/json"
+DEFAULT_GAZETTEER_PATH = os.environ.get(
+    "GAZETTEER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.csv"),
+)
+
+# Google allows 50 QPS per project; stay comfortably below it by default.
+DEFAULT_REQUESTS_PER_SECOND = 25
+DEFAULT_MAX_IN_FLIGHT = 10
+DEFAULT_TIMEOUT = (3.05, 10)    # (connect, read) seconds
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+RETRYABLE_STATUSES = {'OVER_QUERY_LIMIT', 'OVER_DAILY_LIMIT', 'UNKNOWN_ERROR'}
+# Per-second quota: the rate is lowered and the lookup retried. A daily limit does not clear
+# within a run, so it counts as an ordinary transient failure.
+QUOTA_STATUSES = {'OVER_QUERY_LIMIT'}
+QUOTA_BACKOFF = 1.0             # seconds; quota windows are one second long
+DEFAULT_MAX_QUOTA_RETRIES = 30
+
+POSTAL_CODE_RE = re.compile(r"\b(\d{5})(?:-\d{4})?\b")
+# A ZIP code only counts at the very end, alone or after the state; elsewhere 5 digits are a house number
+TRAILING_POSTAL_CODE_RE = re.compile(r"(?:^|[^\W\d]\s+)(\d{5})(?:-\d{4})?$")
+COUNTRY_SUFFIXES = {"us", "usa", "united states", "united states of america"}
+
+
+def make_session(pool_size=DEFAULT_MAX_IN_FLIGHT):
+    # One keep-alive session whose connection pool is large enough for every worker
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class RetryableGeocodeError(Exception):
+    """Transient failure (quota, 5xx, timeout); the engine retries these with backoff."""
+
+    def __init__(self, message, quota=False):
+        super().__init__(message)
+        self.quota = quota
+
+
+class Geocoder:
+    """Geocoder backend interface: geocode(address) returns (lat, lng) or (None, None).
+
+    Local backends are cheap and run inline; remote ones go through the
+    concurrent, rate-limited engine.
+    """
+
+    name = "geocoder"
+    local = False
+
+    def geocode(self, address):
+        raise NotImplementedError
+
+    def cached(self, address):
+        """(found, lat, lng) from the backend's own cache, without a request; found is False if not cached."""
+        return False, None, None
+
+
+class GoogleGeocoder(Geocoder):
+    """Google Geocoding JSON API (or any server speaking the same protocol at `url`)."""
+
+    name = "google"
+
+    def __init__(self, api_key, url=GEOCODE_URL, session=None, cache=None, timeout=DEFAULT_TIMEOUT):
+        self.api_key = api_key
+        self.url = url
+        self.session = session or make_session()
+        self.cache = cache
+        self.timeout = timeout
+
+    def cached(self, address):
+        if self.cache is None:
+            return False, None, None
+        return self.cache.get(address)
+
+    def geocode(self, address):
+        params = {'address': address, 'key': self.api_key}
+        try:
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            # Timeouts, dropped connections, truncated bodies, ...
+            raise RetryableGeocodeError(f"{type(e).__name__}: {e}") from e
+        if response.status_code == 429:
+            raise RetryableGeocodeError("HTTP 429", quota=True)
+        if response.status_code >= 500:
+            raise RetryableGeocodeError(f"HTTP {response.status_code}")
+        if response.status_code != 200:
+            return None, None
+        try:
+            data = response.json()
+        except ValueError:
+            raise RetryableGeocodeError("Malformed JSON response")
+
+        status = data.get('status') if isinstance(data, dict) else None
+        if status == 'OK':
+            try:
+                location = data['results'][0]['geometry']['location']
+                lat, lng = float(location['lat']), float(location['lng'])
+            except (LookupError, TypeError, ValueError):
+                # An OK reply without a usable location: a miss, but not cached as one
+                return None, None
+            if self.cache is not None:
+                self.cache.set(address, lat, lng)
+            return lat, lng
+        if status in RETRYABLE_STATUSES:
+            raise RetryableGeocodeError(status, quota=status in QUOTA_STATUSES)
+        # Only definitive "no match" answers are cached; errors are retried next run
+        if status == 'ZERO_RESULTS' and self.cache is not None:
+            self.cache.set(address, None, None)
+        return None, None
+
+
+def trailing_postal_code(address):
+    """ZIP code in the final comma-separated part of an address (after the state), or None."""
+    parts = [part.strip() for part in address.split(",") if part.strip()]
+    if parts and normalize_address(parts[-1]) in COUNTRY_SUFFIXES:
+        parts.pop()
+    match = TRAILING_POSTAL_CODE_RE.search(parts[-1]) if parts else None
+    return match.group(1) if match else None
+
+
+class GazetteerGeocoder(Geocoder):
+    """Offline geocoder resolving addresses to postal-code or city centroids.
+
+    The gazetteer is a CSV with columns postal_code, city, state, latitude,
+    longitude, loaded once into in-memory dictionaries.
+    """
+
+    name = "gazetteer"
+    local = True
+
+    def __init__(self, path=DEFAULT_GAZETTEER_PATH):
+        table = pd.read_csv(path, dtype={'postal_code': str, 'city': str, 'state': str})
+        table = table.dropna(subset=['latitude', 'longitude'])
+        coords = list(zip(table['latitude'].astype(float), table['longitude'].astype(float)))
+
+        postal_codes = table['postal_code'].fillna("").str.strip().str.zfill(5)
+        self.by_postal_code = {code: c for code, c in zip(postal_codes, coords) if code.strip("0")}
+        city_keys = (table['city'].fillna("") + " " + table['state'].fillna("")).map(normalize_address)
+        # First row wins for cities spanning several postal codes
+        self.by_city = {}
+        for key, c in zip(city_keys, coords):
+            if key:
+                self.by_city.setdefault(key, c)
+
+    def geocode(self, address):
+        if not isinstance(address, str):
+            return None, None
+        postal_code = trailing_postal_code(address)
+        if postal_code in self.by_postal_code:
+            return self.by_postal_code[postal_code]
+
+        # Fall back to "<city>, <state>" (or a bare city) from the comma-separated parts
+        parts = [normalize_address(POSTAL_CODE_RE.sub("", part)) for part in address.split(",")]
+        candidates = [f"{parts[i - 1]} {parts[i]}".strip() for i in range(len(parts) - 1, 0, -1)]
+        candidates += reversed(parts[1:])
+        for key in candidates:
+            if key in self.by_city:
+                return self.by_city[key]
+        return None, None
+
+
+class TokenBucket:
+    """Blocking token bucket: at most `rate` acquisitions per second, bursts up to `capacity`.
+
+    The rate adapts to the API quota: on_quota_error() halves the rate actually
+    being sent (at most once per `decrease_interval`), and every second without
+    quota errors adds a tenth back, up to the configured rate. Without an
+    explicit `capacity` the burst size follows the current rate.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=1.0, decrease_interval=1.0):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.lowest_rate = self.rate
+        self.decrease_interval = decrease_interval
+        self._capacity = capacity
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._last_change = 0.0
+        self._window_start = self._updated
+        self._window_count = 0
+        self._sent_rate = None      # acquisitions per second over the last full second
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        return float(self._capacity if self._capacity is not None else max(1.0, self.rate))
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._count(now)
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _count(self, now):
+        if now - self._window_start >= 1.0:
+            self._sent_rate = self._window_count / (now - self._window_start)
+            self._window_start = now
+            self._window_count = 0
+        self._window_count += 1
+
+    def on_success(self):
+        with self._lock:
+            now = time.monotonic()
+            if self.rate < self.max_rate and now - self._last_change >= 1.0:
+                self.rate = min(self.max_rate, self.rate + max(1.0, self.rate / 10))
+                self._last_change = now
+
+    def on_quota_error(self):
+        with self._lock:
+            now = time.monotonic()
+            # One decrease per interval, so a burst of errors from the same window counts once
+            if now - self._last_change >= self.decrease_interval:
+                sent = min(self.rate, self._sent_rate or self.rate)
+                self.rate = max(self.min_rate, sent / 2)
+                self.lowest_rate = min(self.lowest_rate, self.rate)
+                self._tokens = min(self._tokens, self.capacity)
+                self._last_change = now
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive transient failures.
+
+    While open, callers wait out the cooldown; the next failure after it
+    re-opens immediately. After `max_trips` consecutive openings without a
+    success the breaker gives up and callers fail fast.
+    """
+
+    def __init__(self, failure_threshold=10, cooldown=15.0, max_trips=4):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.failures = 0
+        self.trips = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def given_up(self):
+        return self.trips >= self.max_trips
+
+    def wait(self):
+        """Block while open. Returns False once the breaker has given up."""
+        while True:
+            with self._lock:
+                if self.given_up:
+                    return False
+                if self.opened_at is None:
+                    return True
+                remaining = self.opened_at + self.cooldown - time.monotonic()
+                if remaining <= 0:
+                    self.opened_at = None
+                    self.failures = self.failure_threshold - 1
+                    return True
+            time.sleep(min(remaining, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.trips = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                self.trips += 1
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on in-flight requests: halve on quota errors, grow by one per window of successes."""
+
+    def __init__(self, max_limit, min_limit=1, decrease_interval=1.0):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = min(min_limit, self.max_limit)
+        self.limit = self.max_limit
+        self.lowest_limit = self.limit
+        self.decrease_interval = decrease_interval
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_quota_error(self):
+        with self._cond:
+            now = time.monotonic()
+            # One decrease per interval, so a burst of errors from the same window counts once
+            if now - self._last_decrease >= self.decrease_interval:
+                self.limit = max(self.min_limit, self.limit // 2)
+                self.lowest_limit = min(self.lowest_limit, self.limit)
+                self._last_decrease = now
+            self._successes = 0
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    # Exponential backoff with full jitter
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def geocode_concurrently(addresses, lookup, requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+                         max_in_flight=DEFAULT_MAX_IN_FLIGHT, on_progress=None,
+                         max_retries=DEFAULT_MAX_RETRIES, breaker=None, stats=None, bucket=None,
+                         max_quota_retries=DEFAULT_MAX_QUOTA_RETRIES, limiter=None):
+    """Call lookup(address) for every address on a thread pool.
+
+    Results are returned in input order. on_progress(done, total) is called from
+    the calling thread, so it is safe to update Streamlit elements from it.
+    RetryableGeocodeError is retried with backoff. Quota errors are retried
+    after a short pause, up to `max_quota_retries` times, without counting
+    towards `max_retries` or the circuit breaker; they lower the request rate
+    and shrink the number of requests in flight. Retry counters are added to
+    `stats` if given.
+    A TokenBucket passed as `bucket` (e.g. shared by concurrent jobs) replaces
+    the per-call `requests_per_second` limit; a CircuitBreaker passed as
+    `breaker` and an AdaptiveConcurrencyLimiter passed as `limiter` (e.g. one
+    per job, across its chunks) replace the per-call ones and `max_in_flight`.
+    """
+    addresses = list(addresses)
+    total = len(addresses)
+    results = [(None, None)] * total
+    if not total:
+        return results
+    if bucket is None and requests_per_second:
+        bucket = TokenBucket(requests_per_second)
+    limiter = limiter or AdaptiveConcurrencyLimiter(max_in_flight)
+    breaker = breaker or CircuitBreaker()
+    counters = {'retries': 0, 'gave_up': 0}
+    counters_lock = threading.Lock()
+
+    def task(i, address):
+        attempt = quota_errors = 0
+        while attempt <= max_retries and quota_errors <= max_quota_retries:
+            if not breaker.wait():
+                break
+            limiter.acquire()
+            quota = False
+            try:
+                if bucket is not None:
+                    bucket.acquire()
+                result = lookup(address)
+            except RetryableGeocodeError as e:
+                quota = e.quota
+                if quota:
+                    limiter.on_quota_error()
+                    if bucket is not None:
+                        bucket.on_quota_error()
+                else:
+                    breaker.record_failure()
+            except Exception:
+                # Anything unexpected fails this address only, never the whole run
+                with counters_lock:
+                    counters['gave_up'] += 1
+                return i, (None, None)
+            else:
+                breaker.record_success()
+                limiter.on_success()
+                if bucket is not None:
+                    bucket.on_success()
+                return i, result
+            finally:
+                limiter.release()
+            if quota:
+                quota_errors += 1
+                delay = random.uniform(0, QUOTA_BACKOFF)
+            else:
+                attempt += 1
+                delay = backoff_delay(attempt - 1)
+            if attempt <= max_retries and quota_errors <= max_quota_retries:
+                with counters_lock:
+                    counters['retries'] += 1
+                time.sleep(delay)
+        with counters_lock:
+            counters['gave_up'] += 1
+        return i, (None, None)
+
+    with ThreadPoolExecutor(max_workers=limiter.max_limit) as pool:
+        futures = [pool.submit(task, i, address) for i, address in enumerate(addresses)]
+        for done, future in enumerate(as_completed(futures), 1):
+            i, result = future.result()
+            results[i] = result
+            if on_progress:
+                on_progress(done, total)
+
+    if stats is not None:
+        stats['retries'] = stats.get('retries', 0) + counters['retries']
+        stats['gave_up'] = stats.get('gave_up', 0) + counters['gave_up']
+        stats['min_concurrency'] = min(stats.get('min_concurrency', limiter.max_limit), limiter.lowest_limit)
+        if bucket is not None:
+            stats['min_rate'] = min(stats.get('min_rate', bucket.max_rate), round(bucket.lowest_rate, 1))
+        stats['circuit_open'] = stats.get('circuit_open', False) or breaker.given_up
+    return results
+
+
+def _geocode_remote(geocoder, addresses, stats, engine_options):
+    # Cache hits are answered inline, once per address; only misses take a token and a request slot
+    cached = [geocoder.cached(address) for address in addresses]
+    results = [(lat, lng) for _, lat, lng in cached]
+    misses = [i for i, (found, _, _) in enumerate(cached) if not found]
+    # Counted per call: the cache object itself is shared by concurrent jobs and sessions
+    stats['cache_hits'] = stats.get('cache_hits', 0) + len(cached) - len(misses)
+    stats['cache_misses'] = stats.get('cache_misses', 0) + len(misses)
+    fetched = geocode_concurrently([addresses.iloc[i] for i in misses], geocoder.geocode, stats=stats,
+                                   **engine_options)
+    for i, result in zip(misses, fetched):
+        results[i] = result
+    return results
+
+
+def fill_missing_coordinates(df, address_column, geocoders, **engine_options):
+    """Geocode each distinct normalized address once and broadcast the results.
+
+    Backends are tried in order; each one only sees the addresses the previous
+    ones could not resolve. Fills df['latitude'] / df['longitude'] in place for
+    rows missing either value and returns a stats dict.
+    """
+    for column in ('latitude', 'longitude'):
+        df[column] = pd.to_numeric(df[column], errors='coerce')
+
+    missing = df['latitude'].isna() | df['longitude'].isna()
+    keys = df.loc[missing, address_column].map(normalize_address)
+    keys = keys[keys != ""]
+    unique_keys = keys[~keys.duplicated()]
+
+    # Look up the original text of the first row for each key
+    remaining = pd.Series(df.loc[unique_keys.index, address_column].values, index=unique_keys.values)
+    resolved = []
+    resolved_by = {}
+    engine_stats = {}
+    for geocoder in geocoders:
+        if remaining.empty:
+            break
+        if geocoder.local:
+            results = [geocoder.geocode(address) for address in remaining]
+        else:
+            results = _geocode_remote(geocoder, remaining, engine_stats, engine_options)
+        coords = pd.DataFrame(results, index=remaining.index, columns=['latitude', 'longitude'], dtype=float)
+        found = coords['latitude'].notna() & coords['longitude'].notna()
+        resolved.append(coords[found])
+        resolved_by[geocoder.name] = int(found.sum())
+        remaining = remaining[~found.values]
+
+    if resolved:
+        coords = pd.concat(resolved)
+        lat = keys.map(coords['latitude'])
+        lng = keys.map(coords['longitude'])
+        found = lat.notna() & lng.notna()
+        df.loc[found[found].index, 'latitude'] = lat[found]
+        df.loc[found[found].index, 'longitude'] = lng[found]
+
+    return {
+        'unique_lookups': len(unique_keys),
+        'lookups_saved': len(keys) - len(unique_keys),
+        'resolved_by': resolved_by,
+        **engine_stats,
+    }
+
+
+def merge_geocode_stats(total, stats):
+    """Add one fill_missing_coordinates() result (e.g. for a chunk) into a running total."""
+    for key, value in stats.items():
+        if key == 'resolved_by':
+            resolved_by = total.setdefault('resolved_by', {})
+            for name, count in value.items():
+                resolved_by[name] = resolved_by.get(name, 0) + count
+        elif key in ('min_concurrency', 'min_rate'):
+            total[key] = min(total.get(key, value), value)
+        elif key == 'circuit_open':
+            total[key] = total.get(key, False) or value
+        else:
+            total[key] = total.get(key, 0) + value
+    return total
@@ -0,0 +1,133 @@
+import importlib.util
+import os
+import time
+from io import BytesIO
+
+import pandas as pd
+
+# Upload parsing shared by the apps: only the columns an app uses are parsed,
+# with compact dtypes applied while reading.
+UPLOAD_TYPES = ["xlsx", "csv", "parquet"]
+COORDINATE_COLUMNS = ("latitude", "longitude")
+CATEGORY_COLUMNS = ("Company Name",)
+DEFAULT_CHUNK_ROWS = 5_000
+
+# python-calamine (Rust) parses xlsx several times faster than openpyxl; used when installed
+EXCEL_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+
+
+def upload_format(file_name):
+    extension = os.path.splitext(file_name or "")[1].lower().lstrip(".")
+    return extension if extension in UPLOAD_TYPES else "xlsx"
+
+
+def read_locations(data, file_name, columns):
+    """Parse an uploaded xlsx, CSV or Parquet file, keeping only `columns` (those present).
+
+    Company names are read as categoricals and coordinates coerced to floats.
+    Returns (df, info) with the reader used, row count and parse time in seconds.
+    """
+    wanted = set(columns)
+    dtype = {column: "category" for column in CATEGORY_COLUMNS if column in wanted}
+    fmt = upload_format(file_name)
+    started = time.perf_counter()
+    if fmt == "csv":
+        reader = "csv"
+        df = pd.read_csv(BytesIO(data), usecols=lambda column: column in wanted, dtype=dtype)
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        reader = "parquet"
+        present = [column for column in pq.read_schema(BytesIO(data)).names if column in wanted]
+        df = pd.read_parquet(BytesIO(data), columns=present)
+        df = df.astype({column: kind for column, kind in dtype.items() if column in df.columns})
+    else:
+        reader = EXCEL_ENGINE
+        df = pd.read_excel(BytesIO(data), engine=EXCEL_ENGINE, usecols=lambda column: column in wanted, dtype=dtype)
+    df = coerce_coordinates(df)
+    seconds = time.perf_counter() - started
+    return df, {"reader": reader, "rows": len(df), "seconds": seconds}
+
+
+def read_upload(data, file_name):
+    """Parse every column of an uploaded file, as uploaded; e.g. to write it back out with coordinates added."""
+    fmt = upload_format(file_name)
+    if fmt == "csv":
+        return pd.read_csv(BytesIO(data))
+    if fmt == "parquet":
+        return pd.read_parquet(BytesIO(data))
+    return pd.read_excel(BytesIO(data), engine=EXCEL_ENGINE)
+
+
+def coerce_coordinates(df):
+    for column in COORDINATE_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors="coerce")
+    return df
+
+
+def iter_location_chunks(data, file_name, columns, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield an uploaded file as DataFrames of at most `chunk_rows` rows, keeping only `columns`.
+
+    Rows are parsed as they are consumed (openpyxl's read-only row iterator,
+    the chunked CSV reader or Parquet record batches), so parsing memory is
+    bounded by the chunk size rather than the file. At least one chunk, maybe
+    empty, is yielded so callers can check the columns.
+    """
+    wanted = set(columns)
+    fmt = upload_format(file_name)
+    if fmt == "csv":
+        chunks = pd.read_csv(BytesIO(data), usecols=lambda column: column in wanted, chunksize=chunk_rows)
+    elif fmt == "parquet":
+        chunks = _parquet_chunks(data, wanted, chunk_rows)
+    else:
+        chunks = _excel_chunks(data, wanted, chunk_rows)
+    yielded = False
+    for chunk in chunks:
+        yielded = True
+        yield coerce_coordinates(chunk)
+    if not yielded:
+        yield pd.DataFrame(columns=list(columns))
+
+
+def combine_chunks(chunks):
+    """One table from streamed chunks, with the same dtypes as read_locations."""
+    df = pd.concat(chunks, ignore_index=True)
+    return df.astype({column: "category" for column in CATEGORY_COLUMNS if column in df.columns})
+
+
+def _excel_chunks(data, wanted, chunk_rows):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        keep = [(i, name) for i, name in enumerate(header) if name in wanted]
+        names = [name for _, name in keep]
+        buffer = []
+        for row in rows:
+            values = [row[i] if i < len(row) else None for i, _ in keep]
+            if all(value is None for value in values):
+                continue
+            buffer.append(values)
+            if len(buffer) >= chunk_rows:
+                yield pd.DataFrame(buffer, columns=names)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=names)
+    finally:
+        workbook.close()
+
+
+def _parquet_chunks(data, wanted, chunk_rows):
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(BytesIO(data))
+    present = [column for column in parquet_file.schema_arrow.names if column in wanted]
+    for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=present):
+        yield batch.to_pandas()
+
+
+def describe_read(info):
+    return f"Parsed {info['rows']:,} rows in {info['seconds']:.2f}s ({info['reader']})."
@@ -0,0 +1,202 @@
+import os
+import pickle
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import pipeline
+from geocoding import (
+    AdaptiveConcurrencyLimiter, CircuitBreaker, TokenBucket, DEFAULT_MAX_IN_FLIGHT, DEFAULT_REQUESTS_PER_SECOND,
+)
+from ingest import DEFAULT_CHUNK_ROWS
+
+# Background geocoding jobs. Scripts submit an upload and poll its job, so a
+# browser refresh or a second session with the same file attaches to the
+# running job instead of starting over. Each geocoded chunk is checkpointed to
+# disk, so a job interrupted by a restart resumes from the last chunk.
+# Finished jobs keep only their status and error once the app has stored the
+# result (see Job.release), so polling sessions do not pin tables in memory.
+DEFAULT_CHECKPOINT_DIR = os.environ.get(
+    "JOB_CHECKPOINT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".job_checkpoints"),
+)
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_FINISHED_JOBS = 32     # finished jobs kept for polling sessions
+
+
+class Job:
+    """State of one geocoding job. Written by its worker thread; safe to read from any thread."""
+
+    def __init__(self, key, file_name):
+        self.key = key
+        self.file_name = file_name
+        self.status = "queued"      # queued, running, done or failed
+        self.rows_read = 0
+        self.resumed_rows = 0
+        self.progress = (0, None)   # rows geocoded / in the file (None when streaming)
+        self.result = None          # (location table, stats) once done, until released
+        self.error = None
+        self.released = False
+        self.submitted = time.time()
+        self._points = []
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def release(self):
+        """Drop the result once it is stored elsewhere (e.g. the dataset cache); status and error stay."""
+        self.result = None
+        self.released = True
+
+    def points(self):
+        """Coordinates geocoded so far, for previews."""
+        with self._lock:
+            points = list(self._points)
+        if not points:
+            return pd.DataFrame(columns=['latitude', 'longitude'], dtype=float)
+        return pd.concat(points, ignore_index=True)
+
+    def _add_chunk(self, chunk, rows_read):
+        points = chunk[['latitude', 'longitude']].dropna().astype(float)
+        with self._lock:
+            self._points.append(points)
+        self.rows_read = rows_read
+
+    def _clear_points(self):
+        # Previews are only shown while the job runs
+        with self._lock:
+            self._points = []
+
+
+class Checkpoint:
+    """Geocoded chunks of one upload, pickled as they complete."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load(self):
+        if not os.path.isdir(self.directory):
+            return []
+        chunks = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".pkl"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    chunks.append(pickle.load(f))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                break
+        return chunks
+
+    def save(self, index, chunk):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{index:06d}.pkl")
+        # Written under a temporary name so an interrupted write never leaves a truncated chunk
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class JobRunner:
+    """Runs geocoding jobs on a small thread pool, one job per upload content hash."""
+
+    def __init__(self, geocoders, max_workers=DEFAULT_JOB_WORKERS, checkpoint_dir=DEFAULT_CHECKPOINT_DIR,
+                 chunk_rows=DEFAULT_CHUNK_ROWS, max_finished=DEFAULT_FINISHED_JOBS, stream=False):
+        self.geocoders = geocoders
+        self.checkpoint_dir = checkpoint_dir
+        self.chunk_rows = chunk_rows
+        # Uploads are parsed at once with the fast reader by default; `stream` parses them chunk by chunk.
+        # submit() can choose either per job.
+        self.stream = stream
+        self.max_finished = max_finished
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="geocode-job")
+        self._jobs = OrderedDict()
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            return self._jobs.get(key)
+
+    def submit(self, key, file_bytes, file_name, retry=False, stream=None, **engine_options):
+        """The job for `key`, queued if there is none yet.
+
+        A finished job (done or failed) is replaced by a new one only when
+        `retry` is set, e.g. to retry addresses that gave up, or when its
+        result was released. `stream` overrides the runner's reader for a new
+        job; a job already running keeps its own.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not (job.finished and (retry or job.released)):
+                return job
+            job = Job(key, file_name)
+            self._jobs[key] = job
+            self._jobs.move_to_end(key)
+            # Jobs at the same rate share one token bucket, so concurrent uploads stay within the quota together
+            rate = engine_options.pop('requests_per_second', DEFAULT_REQUESTS_PER_SECOND)
+            engine_options['bucket'] = self._buckets.setdefault(rate, TokenBucket(rate))
+            # One breaker and concurrency limit per job: an API that is down is given up on once, not once per chunk
+            engine_options['breaker'] = CircuitBreaker()
+            engine_options['limiter'] = AdaptiveConcurrencyLimiter(
+                engine_options.pop('max_in_flight', DEFAULT_MAX_IN_FLIGHT))
+            self._prune()
+        stream = self.stream if stream is None else stream
+        self._pool.submit(self._run, job, file_bytes, stream, engine_options)
+        return job
+
+    def _prune(self):
+        finished = [key for key, job in self._jobs.items() if job.finished]
+        for key in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[key]
+
+    def _checkpoint(self, key, stream):
+        # Chunk boundaries depend on the chunk size and the reader (streaming skips blank rows)
+        reader = "streamed" if stream else "read"
+        return Checkpoint(os.path.join(self.checkpoint_dir, f"{key}-{self.chunk_rows}-{reader}"))
+
+    def _run(self, job, file_bytes, stream, engine_options):
+        job.status = "running"
+        checkpoint = self._checkpoint(job.key, stream)
+        resume = checkpoint.load()
+        job.resumed_rows = sum(len(chunk) for chunk in resume)
+        saved = len(resume)
+
+        def on_chunk(chunk, rows_read):
+            nonlocal saved
+            index = len(job._points)
+            if index >= saved:
+                checkpoint.save(index, chunk)
+                saved = index + 1
+            job._add_chunk(chunk, rows_read)
+
+        def on_progress(done, total):
+            job.progress = (done, total)
+
+        try:
+            job.result = pipeline.geocode_workbook_chunks(
+                file_bytes, job.file_name, self.geocoders, on_chunk=on_chunk, on_progress=on_progress,
+                chunk_rows=self.chunk_rows, resume=resume, stream=stream, **engine_options,
+            )
+        except ValueError as e:
+            job.error = str(e)
+            job.status = "failed"
+            checkpoint.clear()
+        except Exception as e:
+            # Checkpoints are kept: retrying the job resumes from them
+            job.error = f"Geocoding failed: {type(e).__name__}: {e}"
+            job.status = "failed"
+        else:
+            job.status = "done"
+            checkpoint.clear()
+        finally:
+            job._clear_points()
@@ -0,0 +1,115 @@
+import colorsys
+import hashlib
+
+from branca.element import MacroElement
+from folium.template import Template
+
+# Company colors and the map legend shared by the apps.
+LEGEND_ROW_HEIGHT = 20
+LEGEND_MAX_HEIGHT = 300     # px; longer lists scroll
+LEGEND_SEARCH_MIN = 12      # show the search box from this many companies
+
+
+def company_color(company):
+    """Stable color for a company name: hue, saturation and lightness derived from a hash of the name.
+
+    The same name gets the same color in every run and process, whatever the
+    other companies in the workbook.
+    """
+    digest = hashlib.blake2b(str(company).encode("utf-8"), digest_size=8).digest()
+    hue = int.from_bytes(digest[:4], "big") / 2 ** 32
+    saturation = 0.65 + digest[4] / 255 * 0.30     # 65-95%: vivid, never grey
+    lightness = 0.38 + digest[5] / 255 * 0.20      # 38-58%: readable on light tiles
+    red, green, blue = colorsys.hls_to_rgb(hue, lightness, saturation)
+    return "#{:02x}{:02x}{:02x}".format(round(red * 255), round(green * 255), round(blue * 255))
+
+
+def company_palette(companies):
+    return [company_color(company) for company in companies]
+
+
+class CompanyLegend(MacroElement):
+    """Fixed-position company legend that only puts the visible rows in the DOM.
+
+    Names and colors travel as two JSON arrays; the rows in the scrolled view
+    are drawn on scroll, so thousands of companies cost a handful of elements.
+    Longer lists get a search box.
+    """
+
+    _template = Template(
+        """
+        {% macro html(this, kwargs) %}
+            <div id="{{ this.element_id }}" style="position: fixed; bottom: 50px; left: 50px; width: 250px; background-color: white; border:2px solid grey; z-index:9999; font-size:14px; color:#000000; padding:10px;">
+                <b style="color:#0000FF;">{{ this.title }}</b>
+                {% if this.searchable %}
+                <input type="search" placeholder="Search companies" style="display:block; width:100%; box-sizing:border-box; margin:6px 0;">
+                <div class="legend-count" style="font-size:12px; color:#555555;"></div>
+                {% endif %}
+                <div class="legend-viewport" style="position:relative; overflow-y:auto; max-height:{{ this.max_height }}px;">
+                    <div class="legend-rows" style="position:relative;"></div>
+                </div>
+            </div>
+        {% endmacro %}
+
+        {% macro script(this, kwargs) %}
+            (function(){
+                var names = {{ this.companies|tojson }};
+                var colors = {{ this.colors|tojson }};
+                var rowHeight = {{ this.row_height }};
+                var root = document.getElementById({{ this.element_id|tojson }});
+                var viewport = root.querySelector(".legend-viewport");
+                var rows = root.querySelector(".legend-rows");
+                var search = root.querySelector("input");
+                var count = root.querySelector(".legend-count");
+                var shown = [];
+
+                function escapeHtml(text) {
+                    return text.replace(/[&<>"]/g, function(c) {
+                        return {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}[c];
+                    });
+                }
+                function draw() {
+                    var first = Math.floor(viewport.scrollTop / rowHeight);
+                    var last = Math.min(shown.length, first + Math.ceil(viewport.clientHeight / rowHeight) + 1);
+                    var html = "";
+                    for (var k = first; k < last; k++) {
+                        var i = shown[k];
+                        html += '<div style="position:absolute; left:0; right:0; top:' + k * rowHeight + 'px; height:'
+                            + rowHeight + 'px; white-space:nowrap; overflow:hidden; text-overflow:ellipsis;">'
+                            + '<i style="background:' + colors[i] + '; width:15px; height:15px; float:left; margin:2px 8px 0 0;"></i>'
+                            + escapeHtml(names[i]) + '</div>';
+                    }
+                    rows.innerHTML = html;
+                }
+                function filter() {
+                    var query = search ? search.value.trim().toLowerCase() : "";
+                    shown = [];
+                    for (var i = 0; i < names.length; i++) {
+                        if (!query || names[i].toLowerCase().indexOf(query) !== -1) { shown.push(i); }
+                    }
+                    rows.style.height = shown.length * rowHeight + "px";
+                    viewport.scrollTop = 0;
+                    if (count) {
+                        count.textContent = shown.length.toLocaleString() + " of " + names.length.toLocaleString() + " companies";
+                    }
+                    draw();
+                }
+                viewport.addEventListener("scroll", draw);
+                if (search) { search.addEventListener("input", filter); }
+                filter();
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, companies, colors, title="Company Legend", max_height=LEGEND_MAX_HEIGHT,
+                 row_height=LEGEND_ROW_HEIGHT, searchable=None):
+        super().__init__()
+        self._name = "CompanyLegend"
+        # Fixed DOM id: st_folium renames the element's variables after the html is rendered
+        self.element_id = f"company-legend-{self._id}"
+        self.companies = [str(company) for company in companies]
+        self.colors = list(colors)
+        self.title = title
+        self.max_height = max_height
+        self.row_height = row_height
+        self.searchable = len(self.companies) >= LEGEND_SEARCH_MIN if searchable is None else searchable
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+# Memory-compact form of a geocoded location table, shared between reruns and
+# sessions through the dataset cache.
+COORDINATE_DECIMALS = 6     # ~0.1 m, for coordinates written into map pages
+INTERN_MAX_UNIQUE_SHARE = 0.5
+
+
+def intern_strings(values):
+    """Dictionary-encode (categorical) a text column when values repeat enough for it to pay off."""
+    values = pd.Series(values)
+    if len(values) and values.nunique(dropna=True) <= len(values) * INTERN_MAX_UNIQUE_SHARE:
+        return values.astype("category")
+    return values
+
+
+def compact_locations(df, address_column):
+    """Compact copy of a location table: only the mapped columns, categorical company
+    names and interned addresses. Coordinates stay float64 so downloads keep the
+    uploaded values exactly; only the map and index paths narrow them.
+
+    Rows with coordinates come first, grouped by company (in order of first
+    appearance), so the mappable rows and each company's rows are contiguous
+    slices that can be read without copying. The original row labels are kept;
+    `in_original_order` restores the uploaded order.
+    """
+    companies = df['Company Name']
+    mapped = (df['latitude'].notna() & df['longitude'].notna()).to_numpy()
+    codes, _ = pd.factorize(companies)
+    order = np.lexsort((codes, ~mapped))
+    return pd.DataFrame({
+        'Company Name': companies.astype("category"),
+        address_column: intern_strings(df[address_column]),
+        'latitude': pd.to_numeric(df['latitude'], errors='coerce').astype(float),
+        'longitude': pd.to_numeric(df['longitude'], errors='coerce').astype(float),
+    }, index=df.index).iloc[order]
+
+
+def mapped_rows(table):
+    """Rows of a compact table that have coordinates: a leading slice, not a copy."""
+    mapped = int((table['latitude'].notna() & table['longitude'].notna()).sum())
+    return table.iloc[:mapped]
+
+
+def in_original_order(table):
+    """The table in upload order, e.g. for downloads."""
+    return table.sort_index()
+
+
+def memory_bytes(obj):
+    """Approximate memory held by a DataFrame, a numpy-array holder (indexes), a list of those, or a byte count."""
+    if obj is None:
+        return 0
+    if isinstance(obj, (int, np.integer)):
+        return int(obj)
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if isinstance(usage, pd.Series) else int(usage)
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (list, tuple)):
+        return sum(memory_bytes(item) for item in obj)
+    if isinstance(obj, dict):
+        return sum(memory_bytes(value) for value in obj.values())
+    return sum(memory_bytes(value) for value in vars(obj).values()
+               if isinstance(value, (np.ndarray, pd.DataFrame, pd.Series, pd.Index)))
+
+
+def memory_report(**objects):
+    """One row per named object with its size in MB."""
+    return pd.DataFrame(
+        {'MB': [round(memory_bytes(obj) / 1e6, 2) for obj in objects.values()]},
+        index=pd.Index(list(objects), name='Data'),
+    )
@@ -0,0 +1,20 @@
+import gzip
+
+# Shareable HTML exports of a folium map.
+
+
+def minify_html(html):
+    """Drop indentation and blank lines. Line breaks are kept, so inline scripts parse exactly as before."""
+    return "\n".join(stripped for stripped in (line.strip() for line in html.splitlines()) if stripped)
+
+
+def export_html(m, minify=False, compress=False):
+    """Rendered page as UTF-8 bytes, optionally minified and gzip-compressed."""
+    html = m.get_root().render()
+    if minify:
+        html = minify_html(html)
+    data = html.encode("utf-8")
+    if compress:
+        # mtime=0 keeps the output byte-identical for the same map
+        data = gzip.compress(data, compresslevel=9, mtime=0)
+    return data
@@ -0,0 +1,520 @@
+import base64
+import json
+
+import folium
+from branca.element import Element
+import numpy as np
+import pandas as pd
+from folium.elements import ElementAddToElement
+from folium.map import Layer
+from folium.plugins import MarkerCluster
+from folium.template import Template
+from folium.utilities import JsCode
+
+from clustering import RAW_POINTS_ZOOM, VIEW_MARGIN, viewport_mask
+from density import DENSITY_CELL_PIXELS, density_view, hex_size
+from location_table import COORDINATE_DECIMALS
+from partition_index import PartitionIndex
+
+# Above this many points the apps switch to the canvas point renderer
+LARGE_DATASET_THRESHOLD = 50_000
+# Most points shipped per view in viewport-loading mode
+MAX_VIEW_POINTS = 5_000
+
+
+def coordinate_list(values):
+    # Rounded to ~0.1 m: full float64 digits only make the page larger
+    return np.round(np.asarray(values, dtype=float), COORDINATE_DECIMALS).tolist()
+
+
+def text_list(values):
+    # Missing values as "", also for categorical columns
+    values = pd.Series(values).astype(object)
+    return values.where(values.notna(), "").astype(str).tolist()
+
+
+def company_feature_collection(rows, address_column):
+    # Built straight from the column arrays; one small dict per point instead of a folium object
+    lats = coordinate_list(rows['latitude'])
+    lngs = coordinate_list(rows['longitude'])
+    addresses = text_list(rows[address_column])
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lng, lat]},
+                "properties": {"address": address},
+            }
+            for lat, lng, address in zip(lats, lngs, addresses)
+        ],
+    }
+
+
+def company_marker_layer(rows, company, color, address_column, radius=6, **kwargs):
+    """FeatureGroup with one folium.CircleMarker per row."""
+    fg = folium.FeatureGroup(**kwargs)
+    lats = coordinate_list(rows['latitude'])
+    lngs = coordinate_list(rows['longitude'])
+    for lat, lng, address in zip(lats, lngs, text_list(rows[address_column])):
+        folium.CircleMarker(
+            location=[lat, lng],
+            radius=radius,
+            color=color,
+            fill=True,
+            fill_color=color,
+            popup=f"<b>{company}</b><br>{address}"
+        ).add_to(fg)
+    return fg
+
+
+def company_fingerprints(rows, columns):
+    """Cheap per-company content fingerprint: row count plus the wrapping sum of row hashes."""
+    hashes = pd.util.hash_pandas_object(rows[columns], index=False)
+    totals = hashes.groupby(rows['Company Name'].to_numpy(), sort=False).agg(['sum', 'size'])
+    return {company: f"{int(total):016x}-{int(size)}" for company, total, size in
+            zip(totals.index, totals['sum'], totals['size'])}
+
+
+def render_layer_script(layer):
+    """Render the script of `layer` and everything under it, except the final addTo(parent)."""
+    scratch = folium.Map(tiles=None)
+    layer.add_to(scratch)
+    figure = scratch.get_root()
+    figure.render()
+
+    names = set()
+
+    def collect(element):
+        names.add(element.get_name())
+        for child in element._children.values():
+            collect(child)
+
+    collect(layer)
+    own_add = layer._children.get(layer.get_name() + "_add")
+    if own_add is not None:
+        names.discard(own_add.get_name())
+    return "\n".join(
+        element.render() for name, element in figure.script._children.items() if name in names
+    )
+
+
+class RawScript(Element):
+    """Script text added to the figure as is (branca would otherwise compile it as a template)."""
+
+    def __init__(self, text):
+        super().__init__()
+        self.text = text
+
+    def render(self, **kwargs):
+        return self.text
+
+
+class PrerenderedLayer(Layer):
+    """A layer whose script was rendered once.
+
+    Holds only a string, so it pickles (and therefore caches) cheaply, and can
+    be added to any number of new maps, including under a MarkerCluster or a
+    LayerControl.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            {{ this.script }}
+        {% endmacro %}"""
+    )
+
+    def __init__(self, layer):
+        self._var_name = layer.get_name()
+        super().__init__(name=layer.layer_name, overlay=layer.overlay, control=layer.control, show=layer.show)
+        self.script = render_layer_script(layer)
+
+    def get_name(self):
+        return self._var_name
+
+    def render(self, **kwargs):
+        # Layer.render, except that the script is added as is
+        if self.show:
+            self.add_child(
+                ElementAddToElement(element_name=self.get_name(), element_parent_name=self._parent.get_name()),
+                name=self.get_name() + "_add",
+            )
+        self.get_root().script.add_child(RawScript(self.script), name=self.get_name())
+        for child in self._children.values():
+            child.render(**kwargs)
+
+
+def js_string(text):
+    return json.dumps(str(text)).replace("</", "<\\/")
+
+
+def company_geojson_layer(rows, company, color, address_column, radius=6, **kwargs):
+    """One GeoJSON layer for all of a company's points.
+
+    Renders the same circle markers and popups as one folium.CircleMarker per
+    row, but with a single style and popup function for the whole layer.
+    """
+    popup_prefix = js_string(f"<b>{company}</b><br>")
+    return folium.GeoJson(
+        company_feature_collection(rows, address_column),
+        marker=folium.CircleMarker(radius=radius, fill=True),
+        style_function=lambda feature: {'color': color, 'fillColor': color},
+        on_each_feature=JsCode(
+            f"function(feature, layer) {{ layer.bindPopup({popup_prefix} + feature.properties.address); }}"
+        ),
+        **kwargs,
+    )
+
+
+def pack_array(values, dtype):
+    # Little-endian typed array bytes, base64 encoded; decoded into a JS typed array client side
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+
+UNPACK_JS = """function unpack(text, ArrayType) {
+                    var bytes = Uint8Array.from(atob(text), function(c) { return c.charCodeAt(0); });
+                    return new ArrayType(bytes.buffer);
+                }"""
+
+
+class CanvasPointCluster(MarkerCluster):
+    """High-volume point layer: compact arrays in the page, canvas drawing, client-side clustering.
+
+    Coordinates travel as base64 Int32 arrays (degrees * 1e5) and company
+    indexes as a Uint16/Uint32 array; markers are created in the browser and
+    drawn on a shared canvas renderer. Popups are bound on click.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.unpack_js }}
+                var lat = unpack("{{ this.lat }}", Int32Array);
+                var lng = unpack("{{ this.lng }}", Int32Array);
+                var codes = unpack("{{ this.codes }}", {{ this.code_type }});
+                var companies = {{ this.companies|tojson }};
+                var colors = {{ this.colors|tojson }};
+                var addresses = {{ this.addresses|tojson }};
+                var renderer = L.canvas({padding: 0.5});
+
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+                var markers = new Array(lat.length);
+                for (var i = 0; i < lat.length; i++) {
+                    var color = colors[codes[i]];
+                    var marker = L.circleMarker([lat[i] / 1e5, lng[i] / 1e5], {
+                        renderer: renderer, radius: {{ this.radius }},
+                        color: color, fillColor: color, fill: true, fillOpacity: 0.2, weight: 3
+                    });
+                    marker.pointIndex = i;
+                    markers[i] = marker;
+                }
+                cluster.addLayers(markers);
+                cluster.on("click", function(e) {
+                    var i = e.layer.pointIndex;
+                    var html = "<b>" + companies[codes[i]] + "</b>";
+                    if (addresses) { html += "<br>" + addresses[i]; }
+                    e.layer.bindPopup(html).openPopup();
+                });
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, lats, lngs, codes, companies, colors, addresses=None, radius=6,
+                 name=None, overlay=True, control=True, show=True, **kwargs):
+        kwargs.setdefault("chunked_loading", True)
+        super().__init__(name=name, overlay=overlay, control=control, show=show, **kwargs)
+        self._name = "CanvasPointCluster"
+        self.unpack_js = UNPACK_JS
+        self.lat = pack_array(np.round(np.asarray(lats, dtype=float) * 1e5), "<i4")
+        self.lng = pack_array(np.round(np.asarray(lngs, dtype=float) * 1e5), "<i4")
+        code_dtype, self.code_type = ("<u2", "Uint16Array") if len(companies) <= 0xFFFF else ("<u4", "Uint32Array")
+        self.codes = pack_array(codes, code_dtype)
+        self.companies = [str(company) for company in companies]
+        self.colors = list(colors)
+        self.addresses = None if addresses is None else [
+            "" if address != address else str(address) for address in addresses
+        ]
+        self.radius = radius
+
+
+class CompactPointLayer(Layer):
+    """One company's points as packed coordinate arrays sharing a single style.
+
+    Draws the same circle markers and popups as `company_marker_layer`, but the
+    page carries two base64 Int32 arrays (degrees * 1e5) and the address list
+    instead of a marker definition and popup per row. Popups are bound on click.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.unpack_js }}
+                var lat = unpack("{{ this.lat }}", Int32Array);
+                var lng = unpack("{{ this.lng }}", Int32Array);
+                var addresses = {{ this.addresses|tojson }};
+                var style = {
+                    renderer: L.canvas({padding: 0.5}), radius: {{ this.radius }},
+                    color: {{ this.color|tojson }}, fillColor: {{ this.color|tojson }},
+                    fill: true, fillOpacity: 0.2, weight: 3
+                };
+                var group = L.featureGroup();
+                for (var i = 0; i < lat.length; i++) {
+                    var marker = L.circleMarker([lat[i] / 1e5, lng[i] / 1e5], style);
+                    marker.pointIndex = i;
+                    group.addLayer(marker);
+                }
+                group.on("click", function(e) {
+                    e.layer.bindPopup({{ this.popup_prefix|tojson }} + addresses[e.layer.pointIndex]).openPopup();
+                });
+                return group;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, rows, company, color, address_column, radius=6, name=None, overlay=True, control=True,
+                 show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "CompactPointLayer"
+        self.unpack_js = UNPACK_JS
+        self.lat = pack_array(np.round(rows['latitude'].to_numpy(dtype=float) * 1e5), "<i4")
+        self.lng = pack_array(np.round(rows['longitude'].to_numpy(dtype=float) * 1e5), "<i4")
+        self.addresses = text_list(rows[address_column])
+        self.popup_prefix = f"<b>{company}</b><br>"
+        self.color = color
+        self.radius = radius
+
+
+class ClusterAggregateLayer(Layer):
+    """Precomputed cluster cells: one circle per cell, sized by count and colored by its dominant company.
+
+    Clicking a cell zooms in on it.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.unpack_js }}
+                var lat = unpack("{{ this.lat }}", Int32Array);
+                var lng = unpack("{{ this.lng }}", Int32Array);
+                var counts = unpack("{{ this.counts }}", Uint32Array);
+                var codes = unpack("{{ this.codes }}", Uint32Array);
+                var shares = unpack("{{ this.shares }}", Uint8Array);
+                var companies = {{ this.companies|tojson }};
+                var colors = {{ this.colors|tojson }};
+
+                var group = L.featureGroup();
+                for (var i = 0; i < lat.length; i++) {
+                    var color = colors[codes[i]];
+                    var label = counts[i] == 1 ? "1 location" : counts[i].toLocaleString() + " locations";
+                    L.circleMarker([lat[i] / 1e5, lng[i] / 1e5], {
+                        radius: Math.min(40, 6 + 3 * Math.sqrt(counts[i])),
+                        color: color, fillColor: color, fillOpacity: 0.55, weight: 2
+                    }).bindTooltip(
+                        "<b>" + label + "</b><br>mostly " + companies[codes[i]] + " (" + shares[i] + "%)"
+                    ).on("click", function(e) {
+                        this._map.setView(e.latlng, this._map.getZoom() + 2);
+                    }).addTo(group);
+                }
+                group.addTo({{ this._parent.get_name() }});
+                return group;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, aggregates, companies, colors, name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "ClusterAggregateLayer"
+        self.unpack_js = UNPACK_JS
+        self.lat = pack_array(np.round(aggregates['latitude'].to_numpy(dtype=float) * 1e5), "<i4")
+        self.lng = pack_array(np.round(aggregates['longitude'].to_numpy(dtype=float) * 1e5), "<i4")
+        self.counts = pack_array(aggregates['count'], "<u4")
+        self.codes = pack_array(aggregates['dominant_code'], "<u4")
+        shares = np.round(aggregates['dominant_count'].to_numpy() / np.maximum(aggregates['count'].to_numpy(), 1) * 100)
+        self.shares = pack_array(shares, "u1")
+        self.companies = [str(company) for company in companies]
+        self.colors = list(colors)
+
+
+# Sequential ramp (light to dark) for density cells, on a log scale of the count
+DENSITY_COLORS = ["#ffffb2", "#fed976", "#feb24c", "#fd8d3c", "#fc4e2a", "#e31a1c", "#b10026"]
+
+
+class DensityLayer(Layer):
+    """Density cells: one canvas polygon per occupied hexagon or square cell, shaded by its count.
+
+    Cell centres travel as world pixel coordinates at the level's zoom; the
+    browser unprojects the corners, so cells stay regular on screen.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                {{ this.unpack_js }}
+                var x = unpack("{{ this.x }}", Float32Array);
+                var y = unpack("{{ this.y }}", Float32Array);
+                var counts = unpack("{{ this.counts }}", Uint32Array);
+                var colors = {{ this.colors|tojson }};
+                var corners = {{ this.corners|tojson }};
+                var zoom = {{ this.zoom }};
+                var scale = Math.log(1 + {{ this.max_count }});
+                var renderer = L.canvas();
+
+                var group = L.featureGroup();
+                for (var i = 0; i < x.length; i++) {
+                    var ring = corners.map(function(c) {
+                        return L.CRS.EPSG3857.pointToLatLng(L.point(x[i] + c[0], y[i] + c[1]), zoom);
+                    });
+                    var shade = Math.min(colors.length - 1,
+                                         Math.floor(Math.log(1 + counts[i]) / scale * colors.length));
+                    var label = counts[i] == 1 ? "1 location" : counts[i].toLocaleString() + " locations";
+                    L.polygon(ring, {
+                        renderer: renderer, color: "#ffffff", weight: 0.5,
+                        fillColor: colors[shade], fillOpacity: 0.75
+                    }).bindTooltip(label).addTo(group);
+                }
+                group.addTo({{ this._parent.get_name() }});
+                return group;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, cells, zoom, max_count, shape="hex", cell_pixels=DENSITY_CELL_PIXELS, colors=DENSITY_COLORS,
+                 name=None, overlay=True, control=True, show=True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "DensityLayer"
+        self.unpack_js = UNPACK_JS
+        self.x = pack_array(cells['x'], "<f4")
+        self.y = pack_array(cells['y'], "<f4")
+        self.counts = pack_array(cells['count'], "<u4")
+        self.zoom = int(zoom)
+        self.max_count = max(int(max_count), 1)
+        self.colors = list(colors)
+        if shape == "hex":
+            size = hex_size(cell_pixels)
+            angles = np.radians(np.arange(6) * 60 - 30)
+            self.corners = np.round(np.column_stack([size * np.cos(angles), size * np.sin(angles)]), 3).tolist()
+        else:
+            half = cell_pixels / 2
+            self.corners = [[-half, -half], [half, -half], [half, half], [-half, half]]
+
+
+def density_view_layer(levels, shape, zoom=None, bounds=None, code=None):
+    """Density cells for the current view, overall or for one company code. Returns (layer, cells shown)."""
+    level, cells, max_count = density_view(levels, zoom=zoom, bounds=bounds, code=code)
+    group = folium.FeatureGroup(name="Density")
+    DensityLayer(cells, level, max_count, shape).add_to(group)
+    return group, len(cells)
+
+
+def cluster_view_layer(rows, zoom_levels, companies, colors, address_column, zoom=None, bounds=None):
+    """Layers for the current view: precomputed cells below RAW_POINTS_ZOOM, raw points in view above it."""
+    group = folium.FeatureGroup(name="Locations")
+    zoom = max(min(zoom_levels), int(zoom if zoom is not None else min(zoom_levels)))
+    if zoom < RAW_POINTS_ZOOM:
+        cells = zoom_levels[min(zoom, max(zoom_levels))]
+        cells = cells[viewport_mask(cells['latitude'], cells['longitude'], bounds)]
+        ClusterAggregateLayer(cells, companies, colors).add_to(group)
+        return group
+
+    rows = rows[viewport_mask(rows['latitude'], rows['longitude'], bounds)]
+    partition = PartitionIndex(rows['Company Name'])
+    for company, color in zip(companies, colors):
+        company_rows = partition.take(rows, company)
+        if len(company_rows):
+            company_geojson_layer(company_rows, company, color, address_column).add_to(group)
+    return group
+
+
+def viewport_layer(rows, index, companies, colors, address_column, bounds=None, max_points=MAX_VIEW_POINTS):
+    """Per-company layers for the points inside `bounds` (plus a margin), at most `max_points` of them.
+
+    `index` is a GridIndex over `rows`. Returns (layer, points_shown, points_in_view).
+    """
+    positions = index.query(bounds, margin=VIEW_MARGIN)
+    in_view = len(positions)
+    if in_view > max_points:
+        # Even stride through the view so the sample keeps its spatial spread
+        positions = positions[np.linspace(0, in_view - 1, max_points).astype(np.int64)]
+    view_rows = rows.iloc[positions]
+
+    group = folium.FeatureGroup(name="Locations")
+    partition = PartitionIndex(view_rows['Company Name'])
+    for company, color in zip(companies, colors):
+        company_rows = partition.take(view_rows, company)
+        if len(company_rows):
+            company_geojson_layer(company_rows, company, color, address_column).add_to(group)
+    return group, len(positions), in_view
+
+
+# Spatial query highlights: query sites, matched sites and the lines between them
+QUERY_COLOR = "#1f4e79"
+MATCH_COLOR = "#ffd400"
+MAX_QUERY_LINKS = 5_000
+
+
+def _site_layer(rows, address_column, color, radius, name):
+    # GeoJSON circles with a company + address popup; the company varies per point here
+    lats = coordinate_list(rows['latitude'])
+    lngs = coordinate_list(rows['longitude'])
+    popups = [f"<b>{company}</b><br>{address}"
+              for company, address in zip(text_list(rows['Company Name']), text_list(rows[address_column]))]
+    collection = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lng, lat]},
+                "properties": {"popup": popup},
+            }
+            for lat, lng, popup in zip(lats, lngs, popups)
+        ],
+    }
+    return folium.GeoJson(
+        collection,
+        name=name,
+        marker=folium.CircleMarker(radius=radius, fill=True, weight=2),
+        style_function=lambda feature: {'color': "#000000", 'fillColor': color, 'fillOpacity': 0.9},
+        on_each_feature=JsCode("function(feature, layer) { layer.bindPopup(feature.properties.popup); }"),
+    )
+
+
+def spatial_query_layer(source, target, pairs, address_column, radius_km=None, max_links=MAX_QUERY_LINKS):
+    """FeatureGroup highlighting a spatial_query join: query sites, matched sites and a line per match.
+
+    `pairs` holds source/target row positions as returned by spatial_query.
+    With `radius_km` the query sites also get their search circle. At most
+    `max_links` matches are drawn; a single query site is drawn even without matches.
+    """
+    group = folium.FeatureGroup(name="Query results")
+    shown = pairs.iloc[:max_links]
+    source_positions = np.unique(shown['source'].to_numpy())
+    if len(source) == 1:
+        source_positions = np.array([0])
+    query_rows = source.iloc[source_positions]
+    match_rows = target.iloc[np.unique(shown['target'].to_numpy())]
+
+    if radius_km is not None:
+        for lat, lng in zip(coordinate_list(query_rows['latitude']), coordinate_list(query_rows['longitude'])):
+            folium.Circle([lat, lng], radius=radius_km * 1000, color=QUERY_COLOR, weight=1,
+                          fill=True, fill_opacity=0.05).add_to(group)
+    if len(shown):
+        starts = source.iloc[shown['source'].to_numpy()]
+        ends = target.iloc[shown['target'].to_numpy()]
+        lines = [
+            [[lat1, lng1], [lat2, lng2]]
+            for lat1, lng1, lat2, lng2 in zip(
+                coordinate_list(starts['latitude']), coordinate_list(starts['longitude']),
+                coordinate_list(ends['latitude']), coordinate_list(ends['longitude']),
+            )
+        ]
+        folium.PolyLine(lines, color="#222222", weight=2, opacity=0.6).add_to(group)
+        _site_layer(match_rows, address_column, MATCH_COLOR, 8, "Matches").add_to(group)
+    _site_layer(query_rows, address_column, QUERY_COLOR, 9, "Query sites").add_to(group)
+    return group
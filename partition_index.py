@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+
+class PartitionIndex:
+    """Row positions of every distinct key (e.g. company), built with one pass.
+
+    Keys are factorized once and the row positions stored sorted by key code,
+    so each key's rows are one contiguous slice: looking them up costs time
+    proportional to that key's rows instead of a boolean scan of the table.
+    Keys keep their order of first appearance, like ``Series.unique()``;
+    missing values are not indexed.
+    """
+
+    def __init__(self, values):
+        codes, keys = pd.factorize(pd.Series(values), sort=False)
+        self.codes = codes
+        self.keys = pd.Index(keys)
+        present = codes >= 0
+        self.order = np.flatnonzero(present)[np.argsort(codes[present], kind='stable')]
+        self.counts = np.bincount(codes[present], minlength=len(keys))
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def positions(self, key):
+        """Row positions (ascending) of `key`; empty if it does not occur."""
+        code = self.keys.get_indexer([key])[0]
+        if code < 0:
+            return np.empty(0, dtype=np.int64)
+        return self.order[self.offsets[code]:self.offsets[code + 1]]
+
+    def take(self, df, key):
+        """Rows of `df` (the frame the index was built from) for `key`."""
+        return _rows(df, self.positions(key))
+
+    def items(self, df):
+        """(key, rows) for every key, in order of first appearance."""
+        for code, key in enumerate(self.keys):
+            yield key, _rows(df, self.order[self.offsets[code]:self.offsets[code + 1]])
+
+
+def _rows(df, positions):
+    # A key whose rows are contiguous (e.g. a table grouped by key) is sliced: a view, not a copy
+    if len(positions) and positions[-1] - positions[0] + 1 == len(positions):
+        return df.iloc[positions[0]:positions[-1] + 1]
+    return df.iloc[positions]
@@ -0,0 +1,81 @@
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+# Per-stage timings of the map pipeline. Every finished stage is logged as one
+# JSON line on the "perf" logger: to stderr, or appended to PERF_LOG_FILE when
+# set, ready for a log shipper to scrape.
+PERF_LOG_FILE = os.environ.get("PERF_LOG_FILE")
+
+logger = logging.getLogger("perf")
+if not logger.handlers:
+    logger.addHandler(logging.FileHandler(PERF_LOG_FILE) if PERF_LOG_FILE else logging.StreamHandler(sys.stderr))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB (None where unsupported)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+class PerfRecorder:
+    """Stage records of one script run or batch job, logged as each stage completes.
+
+    `context` fields (app, dataset, ...) are added to every log line.
+    """
+
+    def __init__(self, **context):
+        self.context = context
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Time the block. Fields known only at the end (rows, bytes, ...) can be set on the yielded dict."""
+        record = dict(fields)
+        peak_before = peak_rss_mb()
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - started
+            peak_after = peak_rss_mb()
+            if peak_after is not None:
+                record['peak_rss_mb'] = round(peak_after, 1)
+                # Non-zero when the stage pushed the process to a new memory peak
+                record['peak_growth_mb'] = round(peak_after - peak_before, 1)
+            self.add(name, seconds, **record)
+
+    def add(self, name, seconds, **fields):
+        """Record a stage timed elsewhere (e.g. on a job thread)."""
+        record = {'stage': name, 'seconds': round(seconds, 4), **fields}
+        self.stages.append(record)
+        logger.info(json.dumps({'ts': round(time.time(), 3), **self.context, **record}, default=str))
+        return record
+
+    def table(self):
+        """Stages as a DataFrame, one row per stage."""
+        return pd.DataFrame(self.stages).set_index('stage') if self.stages else pd.DataFrame()
+
+
+def record_geocoding(perf, stats):
+    """Add the read and geocode stages of a pipeline.geocode_workbook* result."""
+    read = stats['read']
+    perf.add('read', read['seconds'], rows=read['rows'], reader=read['reader'])
+    perf.add('geocode', stats.get('geocode_seconds', 0.0), rows=read['rows'],
+             lookups=stats.get('unique_lookups', 0), cache_hits=stats.get('cache_hits', 0),
+             cache_misses=stats.get('cache_misses', 0), gave_up=stats.get('gave_up', 0))
@@ -0,0 +1,414 @@
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import folium
+import pandas as pd
+from folium.plugins import MarkerCluster
+
+from geocode_cache import GeocodeCache, DEFAULT_CACHE_PATH
+from geocoding import (
+    GazetteerGeocoder, GoogleGeocoder, fill_missing_coordinates, make_session, merge_geocode_stats,
+    GEOCODE_URL, DEFAULT_GAZETTEER_PATH, DEFAULT_REQUESTS_PER_SECOND, DEFAULT_MAX_IN_FLIGHT,
+)
+from ingest import (
+    UPLOAD_TYPES, DEFAULT_CHUNK_ROWS, coerce_coordinates, combine_chunks, iter_location_chunks, read_locations,
+    read_upload,
+)
+from legend import CompanyLegend, company_palette
+from location_table import compact_locations, in_original_order, mapped_rows, memory_bytes
+from map_export import export_html
+from map_layers import (
+    CanvasPointCluster, CompactPointLayer, company_fingerprints, company_geojson_layer, company_marker_layer,
+    LARGE_DATASET_THRESHOLD,
+)
+from partition_index import PartitionIndex
+from perf import PerfRecorder, record_geocoding
+from table_export import EXPORT_FORMATS, export_table
+
+# Read -> geocode -> map -> export for one workbook, shared by the Streamlit
+# apps and the batch command line:
+#
+#     python pipeline.py regions/ out/ --workers 8 --formats xlsx,geojson
+LOCATION_COLUMNS = ['Company Name', 'Full Address', 'latitude', 'longitude']
+REQUIRED_COLUMNS = ['Company Name', 'Full Address']
+ADDRESS_COLUMN = 'Full Address'
+VIBRANT_COLORS = [
+    "#FF0000", "#00FF00", "#0000FF", "#FFA500", "#800080",
+    "#008080", "#FF1493", "#FFD700", "#00CED1", "#DC143C"
+]
+
+API_KEY_ENV = "GOOGLE_MAPS_API_KEY"
+
+
+def api_key_from_env():
+    """The Google Maps API key from the environment; ValueError when it is not set."""
+    api_key = os.environ.get(API_KEY_ENV, "").strip()
+    if not api_key:
+        raise ValueError(f"No Google Maps API key: set the {API_KEY_ENV} environment variable.")
+    return api_key
+
+
+def make_geocoders(cache, api_key=None, url=None, gazetteer_path=DEFAULT_GAZETTEER_PATH):
+    """Offline gazetteer first (when available), Google only for what it cannot resolve.
+
+    `api_key` defaults to GOOGLE_MAPS_API_KEY and `url` to GEOCODE_URL from the
+    environment, so the HTTP backend can point at a local stand-in server.
+    """
+    api_key = api_key or api_key_from_env()
+    geocoders = []
+    if gazetteer_path and os.path.exists(gazetteer_path):
+        geocoders.append(GazetteerGeocoder(gazetteer_path))
+    url = url or os.environ.get("GEOCODE_URL", GEOCODE_URL)
+    geocoders.append(GoogleGeocoder(api_key, url=url, session=make_session(), cache=cache))
+    return geocoders
+
+
+def _with_coordinate_columns(df):
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
+        raise ValueError(f"Excel file must contain columns: {REQUIRED_COLUMNS}")
+    if 'latitude' not in df.columns:
+        df['latitude'] = None
+    if 'longitude' not in df.columns:
+        df['longitude'] = None
+    return df
+
+
+def geocode_workbook(file_bytes, file_name, geocoders, on_progress=None, **engine_options):
+    """Parse an uploaded file and fill in missing coordinates.
+
+    Returns (compact location table, stats). Raises ValueError when the
+    required columns are missing.
+    """
+    df, read_info = read_locations(file_bytes, file_name, LOCATION_COLUMNS)
+    df = _with_coordinate_columns(df)
+
+    started = time.perf_counter()
+    stats = fill_missing_coordinates(df, ADDRESS_COLUMN, geocoders, on_progress=on_progress, **engine_options)
+    stats['geocode_seconds'] = time.perf_counter() - started
+    # Present even when no remote backend was asked
+    stats.setdefault('cache_hits', 0)
+    stats.setdefault('cache_misses', 0)
+    stats['read'] = read_info
+    stats['memory_as_read'] = memory_bytes(df)
+    return compact_locations(df, ADDRESS_COLUMN), stats
+
+
+def geocode_workbook_chunks(file_bytes, file_name, geocoders, on_chunk=None, on_progress=None,
+                            chunk_rows=DEFAULT_CHUNK_ROWS, resume=(), stream=True, **engine_options):
+    """geocode_workbook, geocoding the file one chunk of rows at a time.
+
+    on_chunk(chunk, rows_read) is called after each chunk is geocoded, and
+    on_progress(rows geocoded, rows in the file) as geocoding advances over the
+    whole file; the total is None when streaming, as it is not known up front.
+    `resume` holds chunks geocoded by an earlier, interrupted run (same file,
+    `chunk_rows` and `stream`); they are used as they are instead of being
+    geocoded again. With `stream`, the file is also parsed chunk by chunk,
+    which bounds parsing memory; otherwise it is parsed at once with the
+    faster read_locations and split into chunks.
+    """
+    chunks, stats = [], {}
+    geocode_seconds = 0.0
+    if stream:
+        read_info, parse_seconds, total_rows = {'reader': 'streamed'}, 0.0, None
+        reader = iter(iter_location_chunks(file_bytes, file_name, LOCATION_COLUMNS, chunk_rows))
+    else:
+        table, read_info = read_locations(file_bytes, file_name, LOCATION_COLUMNS)
+        parse_seconds, total_rows = read_info['seconds'], len(table)
+        if on_progress:
+            on_progress(0, total_rows)
+        # At least one chunk, maybe empty, like the streamed reader
+        reader = iter([table.iloc[start:start + chunk_rows] for start in range(0, max(len(table), 1), chunk_rows)])
+    while True:
+        started = time.perf_counter()
+        chunk = next(reader, None)
+        parse_seconds += time.perf_counter() - started
+        if chunk is None:
+            break
+        rows_done = sum(len(c) for c in chunks)
+        if len(chunks) < len(resume):
+            chunk = resume[len(chunks)]
+        else:
+            chunk = _with_coordinate_columns(chunk)
+            chunk_progress = None
+            if on_progress:
+                # Lookups done in this chunk, as a share of its rows
+                def chunk_progress(done, total, rows_done=rows_done, size=len(chunk)):
+                    on_progress(rows_done + size * done // total, total_rows)
+            started = time.perf_counter()
+            # Addresses repeated across chunks are answered by the geocode cache
+            merge_geocode_stats(stats, fill_missing_coordinates(
+                chunk, ADDRESS_COLUMN, geocoders, on_progress=chunk_progress, **engine_options))
+            geocode_seconds += time.perf_counter() - started
+        chunks.append(chunk)
+        if on_progress:
+            on_progress(rows_done + len(chunk), total_rows)
+        if on_chunk:
+            on_chunk(chunk, rows_done + len(chunk))
+
+    df = combine_chunks(chunks)
+    # Present even when no chunk was geocoded in this run (all resumed, or an empty file)
+    stats.setdefault('unique_lookups', 0)
+    stats.setdefault('lookups_saved', 0)
+    stats.setdefault('resolved_by', {})
+    stats.setdefault('cache_hits', 0)
+    stats.setdefault('cache_misses', 0)
+    stats['resumed_rows'] = sum(len(chunk) for chunk in resume)
+    stats['geocode_seconds'] = geocode_seconds
+    stats['read'] = {**read_info, 'rows': len(df), 'seconds': parse_seconds}
+    stats['memory_as_read'] = memory_bytes(df)
+    return compact_locations(df, ADDRESS_COLUMN), stats
+
+
+def company_colors(companies):
+    # Stable per-name colors once there are more companies than fixed colors
+    if len(companies) > len(VIBRANT_COLORS):
+        return company_palette(companies)
+    return VIBRANT_COLORS[:len(companies)]
+
+
+def build_company_layer(rows, company, color, use_geojson, clustered):
+    # Inside a MarkerCluster the layer only groups markers; it has no layer-control entry
+    options = {'control': False} if clustered else {'name': company}
+    if use_geojson:
+        # One GeoJSON layer per company instead of one CircleMarker per row
+        return company_geojson_layer(rows, company, color, ADDRESS_COLUMN, **options)
+    return company_marker_layer(rows, company, color, ADDRESS_COLUMN, **options)
+
+
+def generate_map(df, use_clusters, use_geojson=False, large_dataset_threshold=LARGE_DATASET_THRESHOLD,
+                 dynamic_layers=False, partition=None, compact=False, company_layer=None):
+    """Folium map of a compact location table.
+
+    `company_layer(fingerprint, company, color, use_geojson, clustered, valid_rows, partition)`
+    may supply the per-company layers (e.g. from a cache); by default they are
+    built directly.
+    """
+    companies = df['Company Name'].unique()
+    colors = company_colors(companies)
+
+    center_lat = df['latitude'].dropna().mean() if not df['latitude'].dropna().empty else 39.8283
+    center_lon = df['longitude'].dropna().mean() if not df['longitude'].dropna().empty else -98.5795
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=5)
+
+    valid_rows = mapped_rows(df)
+
+    if dynamic_layers:
+        # Points are supplied per view through st_folium's feature_group_to_add; the base map only carries the legend
+        pass
+    elif len(valid_rows) >= large_dataset_threshold or (compact and use_clusters):
+        # Large dataset mode: packed arrays, canvas drawing and client-side clustering
+        CanvasPointCluster(
+            valid_rows['latitude'],
+            valid_rows['longitude'],
+            pd.Index(companies).get_indexer(valid_rows['Company Name']),
+            companies,
+            colors,
+            addresses=valid_rows[ADDRESS_COLUMN],
+        ).add_to(m)
+    elif compact:
+        # Compact export: packed coordinates and one style per company layer
+        if partition is None:
+            partition = PartitionIndex(valid_rows['Company Name'])
+        for company, color in zip(companies, colors):
+            CompactPointLayer(partition.take(valid_rows, company), company, color, ADDRESS_COLUMN,
+                              name=company).add_to(m)
+        folium.LayerControl().add_to(m)
+    else:
+        if partition is None:
+            partition = PartitionIndex(valid_rows['Company Name'])
+        if company_layer is not None:
+            fingerprints = company_fingerprints(valid_rows, ['latitude', 'longitude', ADDRESS_COLUMN])
+        parent = MarkerCluster().add_to(m) if use_clusters else m
+        for company, color in zip(companies, colors):
+            if company_layer is not None:
+                layer = company_layer(
+                    fingerprints.get(company), company, color, use_geojson, use_clusters, valid_rows, partition
+                )
+            else:
+                layer = build_company_layer(partition.take(valid_rows, company), company, color, use_geojson,
+                                            use_clusters)
+            layer.add_to(parent)
+        if not use_clusters:
+            folium.LayerControl().add_to(m)
+
+    # Legend renders only the entries in view; long lists get a search box
+    CompanyLegend(companies, colors).add_to(m)
+
+    return m
+
+
+def geocoded_upload(file_bytes, file_name, df):
+    """Every column of the uploaded file, with missing coordinates filled in from the geocoded table `df`.
+
+    Coordinates already in the file are kept as they are. Rows are matched by
+    position among those with any of LOCATION_COLUMNS set: every reader keeps
+    those rows, in file order (blank rows are dropped by some readers only).
+    """
+    upload = coerce_coordinates(_with_coordinate_columns(read_upload(file_bytes, file_name)))
+    located = upload.index[upload[LOCATION_COLUMNS].notna().any(axis=1).to_numpy()]
+    table = in_original_order(df)
+    table = table[table[LOCATION_COLUMNS].notna().any(axis=1).to_numpy()]
+    if len(located) != len(table):
+        raise ValueError("The uploaded file does not match its geocoded table.")
+    missing = (upload.loc[located, 'latitude'].isna() | upload.loc[located, 'longitude'].isna()).to_numpy()
+    for column in ('latitude', 'longitude'):
+        upload.loc[located[missing], column] = table[column].to_numpy()[missing]
+    return upload
+
+
+def export_locations(df, fmt, file_bytes=None, file_name=None):
+    """The upload with coordinates added, as the bytes of an EXPORT_FORMATS file.
+
+    Without the uploaded file, only the geocoded table's own columns are written.
+    """
+    if file_bytes is None:
+        return export_table(in_original_order(df), fmt)
+    return export_table(geocoded_upload(file_bytes, file_name, df), fmt)
+
+
+# Batch mode. Each worker process opens its own connection to the same SQLite
+# geocode cache, so an address looked up by one worker is a hit for the others.
+_worker = {}
+
+
+def init_worker(cache_path=DEFAULT_CACHE_PATH, api_key=None, url=None, gazetteer_path=DEFAULT_GAZETTEER_PATH):
+    _worker['geocoders'] = make_geocoders(GeocodeCache(cache_path), api_key, url, gazetteer_path)
+
+
+def process_workbook(path, output_dir, formats=("xlsx",), use_clusters=False, use_geojson=False, compact=False,
+                     compress=False, large_dataset_threshold=LARGE_DATASET_THRESHOLD, stream=False,
+                     **engine_options):
+    """Geocode one workbook and write its map and enriched sheets to `output_dir`.
+
+    Writes `<name>_map.html` (`.html.gz` when compressing) and
+    `<name>_geocoded.<format>` per format. Returns a summary dict, with the
+    per-stage records under 'stages'.
+    """
+    if not _worker:
+        init_worker()
+    started = time.perf_counter()
+    perf = PerfRecorder(workbook=os.path.basename(path))
+    with open(path, "rb") as f:
+        file_bytes = f.read()
+    geocode = geocode_workbook_chunks if stream else geocode_workbook
+    df, stats = geocode(file_bytes, os.path.basename(path), _worker['geocoders'], **engine_options)
+    record_geocoding(perf, stats)
+    geocoded = time.perf_counter()
+
+    stem = os.path.splitext(os.path.basename(path))[0]
+    with perf.stage('generate_map', rows=len(mapped_rows(df))):
+        m = generate_map(df, use_clusters, use_geojson, large_dataset_threshold, compact=compact)
+    with perf.stage('render_html') as record:
+        html = export_html(m, minify=compact, compress=compress)
+        record['bytes'] = len(html)
+    outputs = {f"{stem}_map.html" + (".gz" if compress else ""): html}
+    if formats:
+        with perf.stage('read_upload'):
+            upload = geocoded_upload(file_bytes, os.path.basename(path), df)
+    for fmt in formats:
+        with perf.stage(f'export_{fmt}') as record:
+            outputs[f"{stem}_geocoded.{fmt}"] = export_table(upload, fmt)
+            record['bytes'] = len(outputs[f"{stem}_geocoded.{fmt}"])
+    with perf.stage('write'):
+        for name, data in outputs.items():
+            with open(os.path.join(output_dir, name), "wb") as f:
+                f.write(data)
+
+    return {
+        'input': path,
+        'rows': len(df),
+        'mapped': len(mapped_rows(df)),
+        'gave_up': stats.get('gave_up', 0),
+        'cache_hits': stats['cache_hits'],
+        'cache_misses': stats['cache_misses'],
+        'geocode_s': round(geocoded - started, 2),
+        'total_s': round(time.perf_counter() - started, 2),
+        'outputs': sorted(outputs),
+        'stages': perf.stages,
+    }
+
+
+def find_workbooks(input_dir):
+    """Uploadable files in `input_dir`, largest first so long jobs start early."""
+    paths = [
+        os.path.join(input_dir, name) for name in os.listdir(input_dir)
+        if os.path.splitext(name)[1].lower().lstrip(".") in UPLOAD_TYPES and not name.startswith("~$")
+    ]
+    return sorted(paths, key=os.path.getsize, reverse=True)
+
+
+def process_directory(input_dir, output_dir, workers=None, cache_path=DEFAULT_CACHE_PATH, api_key=None,
+                      url=None, requests_per_second=DEFAULT_REQUESTS_PER_SECOND, **options):
+    """Process every workbook in `input_dir` across a process pool; yields summaries as workbooks finish.
+
+    The request rate is split between the workers so that together they keep
+    to `requests_per_second`. A workbook that fails yields {'input', 'error'}.
+    """
+    paths = find_workbooks(input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths) or 1))
+    options['requests_per_second'] = max(1, requests_per_second / workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(cache_path, api_key, url)) as pool:
+        futures = {pool.submit(process_workbook, path, output_dir, **options): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                yield {'input': futures[future], 'error': f"{type(e).__name__}: {e}"}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Geocode and map every workbook in a directory.")
+    parser.add_argument("input_dir", help="directory of xlsx, CSV or Parquet files")
+    parser.add_argument("output_dir", help="where maps and geocoded sheets are written")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--formats", default="xlsx",
+                        help=f"comma-separated sheet formats: {', '.join(EXPORT_FORMATS)}")
+    parser.add_argument("--clusters", action="store_true", help="cluster markers on the map")
+    parser.add_argument("--geojson", action="store_true", help="one GeoJSON layer per company")
+    parser.add_argument("--compact", action="store_true", help="compact, minified map HTML")
+    parser.add_argument("--gzip", action="store_true", help="gzip-compress the map HTML")
+    parser.add_argument("--large-dataset-threshold", type=int, default=LARGE_DATASET_THRESHOLD)
+    parser.add_argument("--stream", action="store_true", help="read and geocode each file in chunks")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="SQLite geocode cache shared by the workers")
+    parser.add_argument("--rps", type=float, default=DEFAULT_REQUESTS_PER_SECOND,
+                        help="total geocoding requests per second across workers")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="per worker")
+    args = parser.parse_args(argv)
+
+    formats = [fmt for fmt in args.formats.split(",") if fmt]
+    unknown = [fmt for fmt in formats if fmt not in EXPORT_FORMATS]
+    if unknown:
+        parser.error(f"unknown format(s): {', '.join(unknown)}")
+    try:
+        api_key = api_key_from_env()
+    except ValueError as e:
+        parser.error(str(e))
+
+    started = time.perf_counter()
+    failed = done = 0
+    for summary in process_directory(
+        args.input_dir, args.output_dir, workers=args.workers, cache_path=args.cache, api_key=api_key,
+        requests_per_second=args.rps, max_in_flight=args.max_in_flight, formats=formats,
+        use_clusters=args.clusters, use_geojson=args.geojson, compact=args.compact, compress=args.gzip,
+        large_dataset_threshold=args.large_dataset_threshold, stream=args.stream,
+    ):
+        done += 1
+        name = os.path.basename(summary['input'])
+        if 'error' in summary:
+            failed += 1
+            print(f"FAILED  {name}: {summary['error']}", flush=True)
+            continue
+        print(f"{name}: {summary['mapped']:,}/{summary['rows']:,} mapped, "
+              f"cache {summary['cache_hits']} hits / {summary['cache_misses']} misses, "
+              f"{summary['geocode_s']:.1f} s geocoding, {summary['total_s']:.1f} s total", flush=True)
+    print(f"{done - failed} of {done} workbooks processed in {time.perf_counter() - started:.1f} s", flush=True)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
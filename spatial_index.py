@@ -0,0 +1,308 @@
+import numpy as np
+
+DEFAULT_CELL_DEGREES = 0.25
+EARTH_RADIUS_KM = 6371.0088
+QUERY_BATCH = 4096          # query points whose candidates are counted per vectorized pass
+MAX_BATCH_CANDIDATES = 1_000_000    # about this many (query, point) distances are measured per vectorized pass
+NEAREST_START_KM = 1.0      # first search radius of a nearest-neighbour query; doubled until enough points
+FINE_CELLS = 16             # nearest-neighbour queries bound distances with cells this many times finer than the grid
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km; arguments broadcast like numpy arrays."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def circle_box(lats, lngs, radius_km):
+    """Half-sizes (dlat, dlng) in degrees of the bounding box of a `radius_km` circle around each point.
+
+    dlng is 180 (the whole parallel) when the circle reaches a pole.
+    """
+    lats = np.asarray(lats, dtype=float)
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = np.full(lats.shape, np.degrees(angle))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.sin(angle) / np.cos(np.radians(lats))
+    whole = (np.abs(lats) + dlat >= 90) | (angle >= np.pi / 2) | ~(ratio < 1)
+    dlng = np.where(whole, 180.0, np.degrees(np.arcsin(np.clip(ratio, -1, 1))))
+    return dlat, dlng
+
+
+def view_box(bounds, margin=0.0):
+    """(south, west, north, east) from st_folium `bounds`, widened by `margin` of the view size."""
+    if not bounds or not bounds.get('_southWest') or bounds['_southWest'].get('lat') is None:
+        return None
+    south, west = bounds['_southWest']['lat'], bounds['_southWest']['lng']
+    north, east = bounds['_northEast']['lat'], bounds['_northEast']['lng']
+    lat_pad = (north - south) * margin
+    lng_pad = (east - west) * margin
+    return south - lat_pad, west - lng_pad, north + lat_pad, east + lng_pad
+
+
+class GridIndex:
+    """Sorted lat/lng grid index over row positions.
+
+    Points are bucketed into fixed-size degree cells and the row positions are
+    stored sorted by cell id, so a bounding-box query touches one contiguous
+    slice per grid row and costs time proportional to the points it returns.
+    """
+
+    def __init__(self, lats, lngs, cell_degrees=DEFAULT_CELL_DEGREES):
+        # float32 (about 1-2 m) halves the index; distances are still computed in float64
+        self.lats = np.asarray(lats, dtype=np.float32)
+        self.lngs = np.asarray(lngs, dtype=np.float32)
+        self.cell_degrees = cell_degrees
+        self.n_cols = int(np.ceil(360 / cell_degrees)) + 1
+        self.n_rows = int(np.ceil(180 / cell_degrees)) + 1
+        cells = self._cell_ids(self._row(self.lats), self._col(self.lngs))
+        self.order = np.argsort(cells, kind='stable')
+        self.sorted_cells = cells[self.order]
+        self._fine = None
+
+    def __len__(self):
+        return len(self.lats)
+
+    def _row(self, lats):
+        return np.clip(((np.asarray(lats) + 90) // self.cell_degrees).astype(np.int64), 0, self.n_rows - 1)
+
+    def _col(self, lngs):
+        return np.clip(((np.asarray(lngs) + 180) // self.cell_degrees).astype(np.int64), 0, self.n_cols - 1)
+
+    def _cell_ids(self, rows, cols):
+        return rows * self.n_cols + cols
+
+    def query_box(self, south, west, north, east):
+        """Row positions (ascending) of points inside the box."""
+        if east < west:  # crosses the antimeridian
+            return np.union1d(self.query_box(south, west, north, 180), self.query_box(south, -180, north, east))
+        row0, row1 = self._row(south), self._row(north)
+        col0, col1 = self._col(west), self._col(east)
+        grid_rows = np.arange(row0, row1 + 1)
+        starts = np.searchsorted(self.sorted_cells, self._cell_ids(grid_rows, col0), side='left')
+        ends = np.searchsorted(self.sorted_cells, self._cell_ids(grid_rows, col1), side='right')
+        if not len(starts) or not (ends - starts).any():
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate([self.order[s:e] for s, e in zip(starts, ends) if e > s])
+        # Edge cells overlap the box only partly
+        lats, lngs = self.lats[candidates], self.lngs[candidates]
+        inside = (lats >= south) & (lats <= north) & (lngs >= west) & (lngs <= east)
+        return np.sort(candidates[inside])
+
+    def query(self, bounds, margin=0.0):
+        box = view_box(bounds, margin)
+        if box is None:
+            return np.arange(len(self.lats))
+        return self.query_box(*box)
+
+    def _column_ranges(self, lngs, dlng):
+        # Up to two column ranges per query: boxes crossing the antimeridian wrap around
+        west, east = lngs - dlng, lngs + dlng
+        whole = dlng >= 180
+        last = self.n_cols - 1
+        first_lo = np.where(whole, 0, self._col(np.where(west < -180, west + 360, west)))
+        first_hi = np.where(whole | (west < -180) | (east > 180), last, self._col(east))
+        wraps = ~whole & ((west < -180) | (east > 180))
+        second_hi = self._col(np.where(east > 180, east - 360, east))
+        return [(first_lo, first_hi, ~np.zeros(len(lngs), dtype=bool)), (np.zeros_like(first_lo), second_hi, wraps)]
+
+    def _spans(self, lats, lngs, radius_km):
+        # (starts, counts) of each query's candidates in sorted order, per grid row offset and column range,
+        # over all queries at once; candidates come from the cells covering each circle's bounding box
+        if not len(lats):
+            return
+        dlat, dlng = circle_box(lats, lngs, radius_km)
+        row_lo, row_hi = self._row(lats - dlat), self._row(lats + dlat)
+        ranges = self._column_ranges(lngs, dlng)
+        for offset in range(int((row_hi - row_lo).max()) + 1):
+            rows = row_lo + offset
+            active = rows <= row_hi
+            for col_lo, col_hi, valid in ranges:
+                starts = np.searchsorted(self.sorted_cells, self._cell_ids(rows, col_lo), side='left')
+                ends = np.searchsorted(self.sorted_cells, self._cell_ids(rows, col_hi), side='right')
+                yield starts, np.where(active & valid, ends - starts, 0)
+
+    def _candidate_counts(self, lats, lngs, radius_km):
+        counts = np.zeros(len(lats), dtype=np.int64)
+        for _, span_counts in self._spans(lats, lngs, radius_km):
+            counts += span_counts
+        return counts
+
+    def _radius_batch(self, lats, lngs, radius_km):
+        found = []
+        for starts, counts in self._spans(lats, lngs, radius_km):
+            total = int(counts.sum())
+            if not total:
+                continue
+            query = np.repeat(np.arange(len(lats)), counts)
+            slots = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+            positions = self.order[slots]
+            distances = haversine_km(lats[query], lngs[query], self.lats[positions], self.lngs[positions])
+            inside = distances <= radius_km[query]
+            found.append((query[inside], positions[inside], distances[inside]))
+        return found
+
+    def _radius_batches(self, lats, lngs, radius_km):
+        """(query slice, matches) per batch of consecutive queries, matches as _radius_batch returns them.
+
+        Batches are split by candidate count rather than query count, so a batch
+        measures about MAX_BATCH_CANDIDATES distances (more only when a single
+        query has more candidates) however the points are clustered.
+        """
+        radius_km = np.broadcast_to(np.asarray(radius_km, dtype=float), lats.shape)
+        for start in range(0, len(lats), QUERY_BATCH):
+            stop = min(start + QUERY_BATCH, len(lats))
+            counts = self._candidate_counts(lats[start:stop], lngs[start:stop], radius_km[start:stop])
+            group = np.cumsum(counts) // MAX_BATCH_CANDIDATES
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(group)) + 1, [len(counts)])) + start
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                batch = slice(lo, hi)
+                yield batch, self._radius_batch(lats[batch], lngs[batch], radius_km[batch])
+
+    def query_radius(self, lats, lngs, radius_km):
+        """Every (query, position, distance_km) with the point within `radius_km` of query point `query`.
+
+        Queries are vectorized in batches: candidates come from the grid cells
+        covering each circle's bounding box and are filtered by haversine
+        distance. Sorted by query, then distance.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        found = []
+        for batch, matches in self._radius_batches(lats, lngs, radius_km):
+            for query, positions, distances in matches:
+                found.append((query + batch.start, positions, distances))
+        return _sorted_matches(found)
+
+    def _fine_cells(self):
+        """The occupied cells FINE_CELLS times finer than the grid, built on first use.
+
+        Returns (GridIndex over the cell centres, point positions sorted by
+        cell, first slot and point count of each cell, km from a centre to its
+        cell's points at most).
+        """
+        if self._fine is None:
+            size = self.cell_degrees / FINE_CELLS
+            n_cols = int(np.ceil(360 / size)) + 1
+            # Longitudes wrapped, so every point is within a corner distance of its cell's centre
+            rows = np.clip(np.floor((self.lats.astype(float) + 90) / size).astype(np.int64), 0, int(180 / size))
+            cols = np.floor((self.lngs.astype(float) + 180) % 360 / size).astype(np.int64) % (n_cols - 1)
+            ids = rows * n_cols + cols
+            order = np.argsort(ids, kind='stable')
+            ids, first, counts = np.unique(ids[order], return_index=True, return_counts=True)
+            centers = GridIndex((ids // n_cols + 0.5) * size - 90, (ids % n_cols + 0.5) * size - 180, self.cell_degrees)
+            # Centre to corner of an equatorial (widest) cell, with room for rounding at cell edges
+            corner_km = 1.01 * haversine_km(0, 0, size / 2, size / 2)
+            self._fine = (centers, order, first, counts, corner_km)
+        return self._fine
+
+    def query_nearest(self, lats, lngs, k=1):
+        """The `k` nearest points to each query point, as (query, position, distance_km) sorted like query_radius.
+
+        Each query has its own search radius, doubled until the grid cells
+        around it hold `k` points (counted, not measured). The occupied fine
+        cells in that radius are then taken nearest centre first: the points of
+        the cells that reach `k` give an upper bound on the k-th distance, and
+        only the other cells that can hold a point within it are measured too.
+        A query near or far from a dense cluster measures a few cells of it,
+        not all of it. The result is exact; which of equally distant points
+        is returned is not specified.
+        """
+        lats = np.asarray(lats, dtype=float)
+        lngs = np.asarray(lngs, dtype=float)
+        k = min(k, len(self))
+        if k <= 0:
+            return _sorted_matches([])
+        centers, _, _, counts, corner_km = self._fine_cells()
+        # Queries in grid order, so neighbouring queries look up neighbouring cells
+        by_cell = np.argsort(self._cell_ids(self._row(lats), self._col(lngs)), kind='stable')
+        lats, lngs = lats[by_cell], lngs[by_cell]
+        pending = np.arange(len(lats))
+        radius = np.full(len(lats), NEAREST_START_KM)
+        found = []
+        while len(pending):
+            short = self._candidate_counts(lats[pending], lngs[pending], radius[pending]) < k
+            radius[pending[short]] *= 2
+            ready, pending = pending[~short], [pending[short]]
+            for batch, matches in centers._radius_batches(lats[ready], lngs[ready], radius[ready]):
+                queries = ready[batch]
+                query, cells, center_km = _nearest_first(matches)
+                # The k-th point is at most a corner distance beyond the centre of the cell that brings the
+                # count to k, and a point that near is in a cell whose centre is within another corner distance
+                kth_center = _kth_center(query, counts[cells], center_km, len(queries), k)
+                reach = kth_center + 2 * corner_km
+                # Cells beyond the radius were not looked at: widen it for queries that need them
+                enough = reach <= radius[queries]
+                retry = queries[~enough]
+                radius[retry] = np.where(np.isinf(reach[~enough]), radius[retry] * 2, reach[~enough])
+                pending.append(retry)
+
+                nearest = enough[query] & (center_km <= kth_center[query])
+                first = self._fine_matches(lats[queries], lngs[queries], query[nearest], cells[nearest], k)
+                bound = np.zeros(len(queries))
+                np.maximum.at(bound, first[0], first[2])
+                further = enough[query] & ~nearest & (center_km <= bound[query] + corner_km)
+                rest = self._fine_matches(lats[queries], lngs[queries], query[further], cells[further], k)
+                for local, positions, distances in (first, rest):
+                    found.append((by_cell[queries[local]], positions, distances))
+            pending = np.concatenate(pending)
+        return _first_k(*_sorted_matches(found), k)
+
+    def _fine_matches(self, lats, lngs, query, cells, k):
+        # The k nearest points of each query among the points of its (query, fine cell) pairs, measured in
+        # batches of about MAX_BATCH_CANDIDATES points
+        _, order, first, counts, _ = self._fine_cells()
+        sizes = counts[cells]
+        group = np.cumsum(sizes) // MAX_BATCH_CANDIDATES
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(group)) + 1, [len(sizes)]))
+        found = []
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            n = sizes[lo:hi]
+            total = int(n.sum())
+            if not total:
+                continue
+            pair_query = np.repeat(query[lo:hi], n)
+            slots = np.repeat(first[cells[lo:hi]] - (np.cumsum(n) - n), n) + np.arange(total)
+            positions = order[slots]
+            distances = haversine_km(lats[pair_query], lngs[pair_query], self.lats[positions], self.lngs[positions])
+            found.append(_first_k(*_nearest_first([(pair_query, positions, distances)]), k))
+        return _first_k(*_nearest_first(found), k)
+
+
+def _kth_center(query, counts, center_km, n_queries, k):
+    # Per query, the centre distance of the cell where the running point count reaches k (inf if it does not);
+    # `query` is sorted and each query's cells are nearest first
+    running = np.cumsum(counts)
+    before = np.concatenate(([0], running))[np.searchsorted(query, np.arange(n_queries))]
+    reached = np.flatnonzero(running - before[query] >= k)
+    queries, first = np.unique(query[reached], return_index=True)
+    kth = np.full(n_queries, np.inf)
+    kth[queries] = center_km[reached[first]]
+    return kth
+
+
+def _nearest_first(found):
+    # Like _sorted_matches for queries numbered within one batch, without the position tie-break: one float
+    # sort key, which still orders distances to a fraction of a millimetre
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    query, positions, distances = (np.concatenate(parts) for parts in zip(*found))
+    order = np.argsort(query * (np.pi * EARTH_RADIUS_KM + 1) + distances)
+    return query[order], positions[order], distances[order]
+
+
+def _first_k(query, positions, distances, k):
+    # The first k matches of each query, from matches sorted by query
+    counts = np.bincount(query)
+    rank = np.arange(len(query)) - (np.cumsum(counts) - counts)[query]
+    keep = rank < k
+    return query[keep], positions[keep], distances[keep]
+
+
+def _sorted_matches(found):
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    query, positions, distances = (np.concatenate(parts) for parts in zip(*found))
+    order = np.lexsort((positions, distances, query))
+    return query[order], positions[order], distances[order]
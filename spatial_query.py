@@ -0,0 +1,40 @@
+import pandas as pd
+
+from spatial_index import GridIndex
+
+# Spatial questions over location tables ("which sites of B are within 10 km
+# of A's", "the nearest site of B to each of A's"), answered for all query
+# sites at once through a GridIndex over the candidate sites.
+
+
+def radius_join(source, target, radius_km, index=None):
+    """Every (source row, target row) pair within `radius_km`, nearest first for each source row.
+
+    Rows are positions in `source` and `target`; `index` is a GridIndex over
+    `target`, built when not given.
+    """
+    index = index if index is not None else GridIndex(target['latitude'], target['longitude'])
+    return _pairs(*index.query_radius(source['latitude'], source['longitude'], radius_km))
+
+
+def nearest_join(source, target, k=1, index=None):
+    """The `k` nearest target rows to every source row, nearest first."""
+    index = index if index is not None else GridIndex(target['latitude'], target['longitude'])
+    return _pairs(*index.query_nearest(source['latitude'], source['longitude'], k))
+
+
+def _pairs(query, positions, distances):
+    return pd.DataFrame({'source': query, 'target': positions, 'distance_km': distances})
+
+
+def pair_table(pairs, source, target, address_column):
+    """Readable join result: company and address of both sites and their distance."""
+    source_rows = source.iloc[pairs['source'].to_numpy()]
+    target_rows = target.iloc[pairs['target'].to_numpy()]
+    return pd.DataFrame({
+        'Company': source_rows['Company Name'].astype(str).to_numpy(),
+        'Address': source_rows[address_column].astype(str).to_numpy(),
+        'Match company': target_rows['Company Name'].astype(str).to_numpy(),
+        'Match address': target_rows[address_column].astype(str).to_numpy(),
+        'Distance (km)': pairs['distance_km'].round(3).to_numpy(),
+    })
@@ -0,0 +1,77 @@
+import json
+from io import BytesIO
+
+# Downloads of a geocoded location table.
+EXPORT_FORMATS = {
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV", "text/csv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+    "geojson": ("GeoJSON", "application/geo+json"),
+}
+EXPORT_CHUNK_ROWS = 10_000
+COORDINATE_COLUMNS = ("latitude", "longitude")
+
+
+def export_table(df, fmt):
+    """`df` as the bytes of an xlsx, CSV, Parquet or GeoJSON file.
+
+    Excel and GeoJSON are written EXPORT_CHUNK_ROWS rows at a time, so only
+    the output buffer grows with the table. GeoJSON holds a Point feature per
+    row with coordinates; the other columns become its properties.
+    """
+    output = BytesIO()
+    if fmt == "xlsx":
+        _write_xlsx(df, output)
+    elif fmt == "csv":
+        df.to_csv(output, index=False, encoding="utf-8", chunksize=EXPORT_CHUNK_ROWS)
+    elif fmt == "parquet":
+        # Spreadsheet columns can mix numbers and text; Parquet needs one type per column
+        mixed = [column for column in df.columns if df[column].dtype == object]
+        df.astype({column: "string" for column in mixed}).to_parquet(output, index=False)
+    elif fmt == "geojson":
+        _write_geojson(df, output)
+    else:
+        raise ValueError(f"Unknown export format: {fmt}")
+    return output.getvalue()
+
+
+def _chunks(df):
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXPORT_CHUNK_ROWS].astype(object)
+        # NaN/NA become empty cells and JSON nulls
+        yield chunk.where(chunk.notna(), None)
+
+
+def _write_xlsx(df, output):
+    from openpyxl import Workbook
+
+    # Write-only mode streams rows to the file instead of keeping a cell object per value
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append([str(column) for column in df.columns])
+    for chunk in _chunks(df):
+        for row in chunk.itertuples(index=False, name=None):
+            sheet.append(row)
+    workbook.save(output)
+
+
+def _write_geojson(df, output):
+    mapped = df.dropna(subset=list(COORDINATE_COLUMNS))
+    properties = [column for column in mapped.columns if column not in COORDINATE_COLUMNS]
+    output.write(b'{"type": "FeatureCollection", "features": [')
+    first = True
+    for chunk in _chunks(mapped):
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": [lng, lat]},
+                "properties": dict(zip(properties, values)),
+            }
+            for lat, lng, values in zip(chunk["latitude"], chunk["longitude"],
+                                        chunk[properties].itertuples(index=False, name=None))
+        ]
+        if not features:
+            continue
+        output.write((("" if first else ", ") + json.dumps(features, default=str)[1:-1]).encode("utf-8"))
+        first = False
+    output.write(b"]}")